@@ -6,8 +6,8 @@ client = bigquery.Client(project='sis-sandbox-463113')
 # Run a simple test query
 sql = 'SELECT "ok" AS status, CURRENT_TIMESTAMP() AS ts'
 print("Testing BigQuery connection...")
-results = list(client.query(sql).result())
-print(f"BigQuery test result: {results}")
+row = next(iter(client.query(sql).result(max_results=1)))
+print(f"BigQuery test result: {row}")
 
 # Test access to the db2_migration dataset
 dataset_id = 'sis-sandbox-463113.db2_migration'
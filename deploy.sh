@@ -50,7 +50,7 @@ echo "Service URL: ${SERVICE_URL}"
 echo ""
 echo "To test the service:"
 echo "TOKEN=\$(gcloud auth print-identity-token)"
-echo "curl -H \"Authorization: Bearer \$TOKEN\" \"${SERVICE_URL}/health\""
+echo "curl -H \"Authorization: Bearer \$TOKEN\" \"${SERVICE_URL}/health?verbose=1\""
 echo ""
 echo "To run a migration:"
 echo "curl -H \"Authorization: Bearer \$TOKEN\" \"${SERVICE_URL}/run?start_date=2025-07-01&end_date=2025-07-31\""
\ No newline at end of file
@@ -1,9 +1,10 @@
 import os
 import logging
-from datetime import datetime, date, timedelta
-from flask import Flask, jsonify, request
-from google.cloud import bigquery
-import socket
+import time
+from datetime import datetime, timedelta
+import orjson
+from flask import Flask, Response, request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Import our modular components
 from queries import po_query, breakout_query
@@ -18,9 +19,50 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Optional per-endpoint profiling (PROFILE=1); results are browsable under /flask-profiler.
+# The dashboard shows request history including query params, so it is only enabled behind
+# basic auth (PROFILE_USER / PROFILE_PASSWORD). flask-profiler is not in requirements.txt:
+# install it with `pip install -r requirements-profile.txt`
+if os.environ.get("PROFILE", "0") == "1":
+    profile_user = os.environ.get("PROFILE_USER", "")
+    profile_password = os.environ.get("PROFILE_PASSWORD", "")
+    if not (profile_user and profile_password):
+        logger.warning("PROFILE=1 ignored: set PROFILE_USER and PROFILE_PASSWORD to protect /flask-profiler")
+    else:
+        app.config["flask_profiler"] = {
+            "enabled": True,
+            "storage": {"engine": "sqlite"},
+            "basicAuth": {"enabled": True, "username": profile_user, "password": profile_password},
+            "ignore": ["^/health$", "^/$"]
+        }
+        try:
+            import flask_profiler
+            flask_profiler.init_app(app)
+            logger.info("flask-profiler enabled")
+        except Exception as e:
+            logger.warning(f"Could not enable flask-profiler: {e}")
+
 # Get project configuration
 DEFAULT_PROJECT = os.environ.get("PROJECT_ID", "sis-sandbox-463113")
 DEFAULT_DATASET = os.environ.get("BQ_DATASET", "db2_migration")
+USE_MOCK_DB_DEFAULT = os.environ.get("USE_MOCK_DB", "0") == "1"
+# Upload PO batches to BigQuery while later batches are still being fetched from DB2
+PIPELINE_LOADS = os.environ.get("PIPELINE_LOADS", "0") == "1"
+
+# Environment reported by /db2-diagnose (read once at import; the process env doesn't change)
+_ENV_SNAPSHOT = {
+    "PROJECT_ID": DEFAULT_PROJECT,
+    "DB2_SECRET_NAME": os.environ.get("DB2_SECRET_NAME", "IBM_connect"),
+    "USE_MOCK_DB": os.environ.get("USE_MOCK_DB", "0"),
+    "DEBUG": os.environ.get("DEBUG", "0"),
+    "BQ_DATASET": DEFAULT_DATASET,
+    "BQ_STAGING_TABLE": os.environ.get("BQ_STAGING_TABLE", "po_inbound_daily"),
+    "BQ_BREAKOUT_STAGING_TABLE": os.environ.get("BQ_BREAKOUT_STAGING_TABLE", "po_breakout_staging")
+}
+
+def _json(payload, status=200):
+    """Serialize payload with orjson (much faster than jsonify for small probe responses)"""
+    return Response(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY), status=status, mimetype="application/json")
 
 @app.get("/")
 def root():
@@ -28,19 +70,30 @@ def root():
 
 @app.get("/health")
 def health():
-    return jsonify({"status": "healthy", "service": "db2-migration-service"})
+    """Liveness probe: empty 204 by default, JSON body with ?verbose=1"""
+    if request.args.get("verbose") == "1":
+        return _json({"status": "healthy", "service": "db2-migration-service"})
+    return "", 204
 
 @app.get("/bq-health")
 def bq_health():
     try:
-        client = bigquery.Client(project=DEFAULT_PROJECT)
-        rows = list(client.query('SELECT "ok" AS status, CURRENT_TIMESTAMP() ts').result())
-        return jsonify({"status": rows[0]["status"], "ts": str(rows[0]["ts"])})
+        client = bq_utils.get_bq_client()
+        row = next(iter(client.query('SELECT "ok" AS status, CURRENT_TIMESTAMP() ts').result(max_results=1)))
+        return _json({"status": row["status"], "ts": str(row["ts"])})
     except Exception as e:
-        return jsonify({"status": "error", "error": str(e)}), 500
+        return _json({"status": "error", "error": str(e)}, 500)
+
+def _maybe_refresh_secret():
+    """Drop the cached DB2 secret when the caller passes ?refresh=1 (e.g. right after a rotation)"""
+    if request.args.get("refresh") == "1":
+        db_utils.invalidate_secret_cache()
+        return True
+    return False
 
 @app.get("/tcpcheck")
 def tcpcheck():
+    _maybe_refresh_secret()
     try:
         cfg = db_utils.get_secret_payload()
         host = request.args.get("host", cfg.get("host"))
@@ -50,20 +103,33 @@ def tcpcheck():
         port = int(request.args.get("port", "446"))
 
     if not host:
-        return jsonify({"error": "Host required. Pass ?host=... or configure in secret"}), 400
+        return _json({"error": "Host required. Pass ?host=... or configure in secret"}, 400)
 
-    s = socket.socket()
-    s.settimeout(3.0)
     try:
-        s.connect((host, port))
-        s.close()
-        return jsonify({"reachable": True, "host": host, "port": port})
+        latency_ms = db_utils.check_tcp(host, port, timeout=3.0)
+        return _json({"reachable": True, "host": host, "port": port, "latency_ms": round(latency_ms, 2)})
     except Exception as e:
-        return jsonify({"reachable": False, "host": host, "port": port, "error": str(e)}), 500
+        return _json({"reachable": False, "host": host, "port": port, "error": str(e)}, 500)
+
+# Last healthy /db2-diagnose result, served to repeated probes without reconnecting to DB2
+DIAG_CACHE_TTL = int(os.environ.get("DIAG_CACHE_TTL", "30"))
+_DIAG_CACHE = {"value": None, "expires": 0.0}
 
 @app.get("/db2-diagnose")
 def db2_diagnose():
-    """Comprehensive DB2 connection diagnostics endpoint"""
+    """
+    Comprehensive DB2 connection diagnostics endpoint.
+
+    Query Parameters:
+        quick: '1' to stop after the environment and secret checks (for startup/readiness probes)
+        nocache: '1' to bypass the cached result of a recent healthy run
+        refresh: '1' to re-read the DB2 secret from Secret Manager (implies nocache)
+    """
+    quick = request.args.get("quick") == "1"
+    refreshed = _maybe_refresh_secret()
+    if not refreshed and request.args.get("nocache") != "1" and time.monotonic() < _DIAG_CACHE["expires"]:
+        return _json({**_DIAG_CACHE["value"], "cached": True})
+
     results = {
         "timestamp": datetime.now().isoformat(),
         "environment": {},
@@ -73,15 +139,7 @@ def db2_diagnose():
     }
 
     # Check environment variables
-    results["environment"] = {
-        "PROJECT_ID": os.environ.get("PROJECT_ID", "sis-sandbox-463113"),
-        "DB2_SECRET_NAME": os.environ.get("DB2_SECRET_NAME", "IBM_connect"),
-        "USE_MOCK_DB": os.environ.get("USE_MOCK_DB", "0"),
-        "DEBUG": os.environ.get("DEBUG", "0"),
-        "BQ_DATASET": os.environ.get("BQ_DATASET", "db2_migration"),
-        "BQ_STAGING_TABLE": os.environ.get("BQ_STAGING_TABLE", "po_inbound_daily"),
-        "BQ_BREAKOUT_STAGING_TABLE": os.environ.get("BQ_BREAKOUT_STAGING_TABLE", "po_breakout_staging")
-    }
+    results["environment"] = _ENV_SNAPSHOT
 
     # Try to get secret configuration
     try:
@@ -94,17 +152,20 @@ def db2_diagnose():
         results["secret_test"]["user"] = config.get("user", "NOT SET")
         results["secret_test"]["ssl_enabled"] = config.get("security") == "SSL"
 
+        if quick:
+            results["overall_status"] = "ok"
+            results["summary"] = "Quick check - environment and secret only, network/DB2 tests skipped"
+            return _json(results)
+
         # Test network connectivity
         host = config.get("host")
         port = config.get("port", 446)
         if host:
             logger.info(f"Testing network connectivity to {host}:{port}")
-            s = socket.socket()
-            s.settimeout(5.0)
             try:
-                s.connect((host, port))
-                s.close()
+                latency_ms = db_utils.check_tcp(host, port, timeout=5.0)
                 results["network_test"]["status"] = "success"
+                results["network_test"]["latency_ms"] = round(latency_ms, 2)
                 results["network_test"]["message"] = f"Successfully connected to {host}:{port}"
             except Exception as e:
                 results["network_test"]["status"] = "failed"
@@ -180,6 +241,8 @@ def db2_diagnose():
         results["overall_status"] = "healthy"
         results["summary"] = "All tests passed - DB2 connection is working"
         status_code = 200
+        _DIAG_CACHE["value"] = results
+        _DIAG_CACHE["expires"] = time.monotonic() + DIAG_CACHE_TTL
     else:
         results["overall_status"] = "unhealthy"
         if results["secret_test"].get("status") == "failed":
@@ -192,7 +255,112 @@ def db2_diagnose():
             results["summary"] = "Unknown issue - check logs"
         status_code = 500
 
-    return jsonify(results), status_code
+    return _json(results, status_code)
+
+def _run_po(start_date, end_date, mock_mode, use_rolling_window, use_merge):
+    """Fetch PO data and load it to BigQuery, returning the result summary"""
+    logger.info(f"Running PO query for date range: {start_date} to {end_date}")
+    if PIPELINE_LOADS and not mock_mode:
+        return _run_po_pipelined(start_date, end_date, use_rolling_window, use_merge)
+    try:
+        # Fetch PO data
+        df_po = po_query.fetch_po_data(
+            start_date=start_date,
+            end_date=end_date,
+            mock_mode=mock_mode,
+            use_rolling_window=use_rolling_window
+        )
+
+        if df_po.empty:
+            return {
+                "status": "no_data",
+                "message": "No PO data found for the specified date range"
+            }
+
+        # Load to BigQuery
+        config = po_query.get_po_config()
+        rows_loaded = bq_utils.load_to_bigquery(df_po, config, use_merge=use_merge)
+        logger.info(f"PO migration completed. Rows loaded: {rows_loaded}")
+
+        return {
+            "status": "success",
+            "rows_fetched": len(df_po),
+            "rows_loaded": rows_loaded
+        }
+
+    except Exception as e:
+        logger.exception(f"Error in PO migration: {e}")
+        return {
+            "status": "error",
+            "error": str(e)
+        }
+
+def _run_po_pipelined(start_date, end_date, use_rolling_window, use_merge):
+    """Stream PO batches from DB2 straight into staging loads, returning the result summary"""
+    try:
+        batches = po_query.fetch_po_batches(
+            start_date=start_date,
+            end_date=end_date,
+            use_rolling_window=use_rolling_window
+        )
+        config = po_query.get_po_config()
+        rows_loaded = bq_utils.load_batches_to_bigquery(batches, config, use_merge=use_merge)
+
+        if rows_loaded == 0:
+            return {
+                "status": "no_data",
+                "message": "No PO data found for the specified date range"
+            }
+
+        logger.info(f"PO migration completed. Rows loaded: {rows_loaded}")
+        return {
+            "status": "success",
+            "rows_fetched": rows_loaded,
+            "rows_loaded": rows_loaded
+        }
+
+    except Exception as e:
+        logger.exception(f"Error in PO migration: {e}")
+        return {
+            "status": "error",
+            "error": str(e)
+        }
+
+def _run_breakout(start_date, end_date, mock_mode, use_rolling_window, use_merge):
+    """Fetch Breakout data and load it to BigQuery, returning the result summary"""
+    logger.info(f"Running Breakout query for date range: {start_date} to {end_date}")
+    try:
+        # Fetch Breakout data
+        df_breakout = breakout_query.fetch_breakout_data(
+            start_date=start_date,
+            end_date=end_date,
+            mock_mode=mock_mode,
+            use_rolling_window=use_rolling_window
+        )
+
+        if df_breakout.empty:
+            return {
+                "status": "no_data",
+                "message": "No breakout data found for the specified date range"
+            }
+
+        # Load to BigQuery
+        config = breakout_query.get_breakout_config()
+        rows_loaded = bq_utils.load_to_bigquery(df_breakout, config, use_merge=use_merge)
+        logger.info(f"Breakout migration completed. Rows loaded: {rows_loaded}")
+
+        return {
+            "status": "success",
+            "rows_fetched": len(df_breakout),
+            "rows_loaded": rows_loaded
+        }
+
+    except Exception as e:
+        logger.exception(f"Error in Breakout migration: {e}")
+        return {
+            "status": "error",
+            "error": str(e)
+        }
 
 @app.route("/run", methods=["GET", "POST"])
 def run_migration():
@@ -206,20 +374,26 @@ def run_migration():
         use_merge: 'true' or 'false' (default: 'true')
         start_date: YYYY-MM-DD (optional if use_rolling_window=true)
         end_date: YYYY-MM-DD (optional if use_rolling_window=true)
+        refresh: '1' to re-read the DB2 secret from Secret Manager before connecting
     """
     try:
+        _maybe_refresh_secret()
+
         # Parse parameters
         query_type = request.args.get("query_type", "both").lower()
         use_rolling_window = request.args.get("use_rolling_window", "true").lower() == "true"
-        mock_mode = os.environ.get("USE_MOCK_DB", "0") == "1" or request.args.get("mock", "false").lower() == "true"
+        mock_mode = USE_MOCK_DB_DEFAULT or request.args.get("mock", "false").lower() == "true"
         use_merge = request.args.get("use_merge", "true").lower() == "true"
 
-        # Get date range
+        # Get date range (single snapshot so all bounds agree even across midnight)
+        now = datetime.now()
+        today = now.date()
         if use_rolling_window:
-            start_date = (date.today() - timedelta(days=30)).strftime("%Y-%m-%d")
-            end_date = (date.today() + timedelta(days=60)).strftime("%Y-%m-%d")
+            start, end = db_utils.rolling_window(today)
+            start_date = start.strftime("%Y-%m-%d")
+            end_date = end.strftime("%Y-%m-%d")
         else:
-            yesterday = (date.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+            yesterday = (today - timedelta(days=1)).strftime("%Y-%m-%d")
             start_date = request.args.get("start_date", request.args.get("date", yesterday))
             end_date = request.args.get("end_date", start_date)
 
@@ -231,147 +405,92 @@ def run_migration():
             "mock_mode": mock_mode,
             "use_rolling_window": use_rolling_window,
             "use_merge": use_merge,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now.isoformat(),
             "results": {}
         }
 
-        # Run PO query if requested
-        if query_type in ["po", "both"]:
-            logger.info(f"Running PO query for date range: {start_date} to {end_date}")
-            try:
-                # Fetch PO data
-                df_po = po_query.fetch_po_data(
-                    start_date=start_date,
-                    end_date=end_date,
-                    mock_mode=mock_mode,
-                    use_rolling_window=use_rolling_window
-                )
-
-                if df_po.empty:
-                    results["results"]["po"] = {
-                        "status": "no_data",
-                        "message": "No PO data found for the specified date range"
-                    }
-                else:
-                    # Load to BigQuery
-                    config = po_query.get_po_config()
-                    rows_loaded = bq_utils.load_to_bigquery(df_po, config, use_merge=use_merge)
-
-                    results["results"]["po"] = {
-                        "status": "success",
-                        "rows_fetched": len(df_po),
-                        "rows_loaded": rows_loaded
-                    }
-                    logger.info(f"PO migration completed. Rows loaded: {rows_loaded}")
-
-            except Exception as e:
-                logger.error(f"Error in PO migration: {str(e)}")
-                results["results"]["po"] = {
-                    "status": "error",
-                    "error": str(e)
-                }
-                results["status"] = "partial_failure"
-
-        # Run Breakout query if requested
-        if query_type in ["breakout", "both"]:
-            logger.info(f"Running Breakout query for date range: {start_date} to {end_date}")
-            try:
-                # Fetch Breakout data
-                df_breakout = breakout_query.fetch_breakout_data(
-                    start_date=start_date,
-                    end_date=end_date,
-                    mock_mode=mock_mode,
-                    use_rolling_window=use_rolling_window
-                )
-
-                if df_breakout.empty:
-                    results["results"]["breakout"] = {
-                        "status": "no_data",
-                        "message": "No breakout data found for the specified date range"
-                    }
-                else:
-                    # Load to BigQuery
-                    config = breakout_query.get_breakout_config()
-                    rows_loaded = bq_utils.load_to_bigquery(df_breakout, config, use_merge=use_merge)
-
-                    results["results"]["breakout"] = {
-                        "status": "success",
-                        "rows_fetched": len(df_breakout),
-                        "rows_loaded": rows_loaded
-                    }
-                    logger.info(f"Breakout migration completed. Rows loaded: {rows_loaded}")
-
-            except Exception as e:
-                logger.error(f"Error in Breakout migration: {str(e)}")
-                results["results"]["breakout"] = {
-                    "status": "error",
-                    "error": str(e)
-                }
-                results["status"] = "partial_failure" if results["status"] == "success" else "error"
+        # Run the requested pipelines; PO and Breakout are independent, so run them side by side
+        # (Breakout on a helper thread, PO on the request thread, each on its own pooled DB2 connection)
+        if query_type == "both":
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                f_breakout = executor.submit(_run_breakout, start_date, end_date, mock_mode, use_rolling_window, use_merge)
+                results["results"]["po"] = _run_po(start_date, end_date, mock_mode, use_rolling_window, use_merge)
+                results["results"]["breakout"] = f_breakout.result()
+        elif query_type == "po":
+            results["results"]["po"] = _run_po(start_date, end_date, mock_mode, use_rolling_window, use_merge)
+        elif query_type == "breakout":
+            results["results"]["breakout"] = _run_breakout(start_date, end_date, mock_mode, use_rolling_window, use_merge)
+
+        if any(r.get("status") == "error" for r in results["results"].values()):
+            results["status"] = "partial_failure"
 
         # Check if any errors occurred
         if all(r.get("status") == "error" for r in results["results"].values()):
             results["status"] = "error"
 
-        return jsonify(results), 500 if results["status"] == "error" else 200
+        return _json(results, 500 if results["status"] == "error" else 200)
 
     except Exception as e:
-        logger.error(f"Error in migration: {str(e)}")
-        import traceback
-        logger.error(f"Full traceback:\n{traceback.format_exc()}")
+        logger.error(f"Error in migration: {e}")
+        logger.debug("Full traceback:", exc_info=True)
 
-        return jsonify({
+        return _json({
             "status": "error",
             "error": str(e),
             "start_date": start_date if 'start_date' in locals() else None,
             "end_date": end_date if 'end_date' in locals() else None
-        }), 500
+        }, 500)
 
 @app.route("/create-tables", methods=["POST"])
 def create_tables():
     """Create BigQuery tables if they don't exist"""
     try:
-        client = bigquery.Client(project=DEFAULT_PROJECT)
+        client = bq_utils.get_bq_client()
         dataset_id = DEFAULT_DATASET
-        created_tables = []
 
-        # Create PO tables
         po_config = po_query.get_po_config()
-        po_staging_id = f"{DEFAULT_PROJECT}.{dataset_id}.{po_config['staging_table']}"
-        po_final_id = f"{DEFAULT_PROJECT}.{dataset_id}.{po_config['final_table']}"
-
-        for table_id in [po_staging_id, po_final_id]:
-            try:
-                schema = bq_utils.get_table_schema("po")
-                bq_utils.create_table_if_not_exists(client, table_id, schema)
-                created_tables.append(table_id)
-            except Exception as e:
-                logger.error(f"Error creating table {table_id}: {e}")
-
-        # Create Breakout tables
         breakout_config = breakout_query.get_breakout_config()
-        breakout_staging_id = f"{DEFAULT_PROJECT}.{dataset_id}.{breakout_config['staging_table']}"
-        breakout_final_id = f"{DEFAULT_PROJECT}.{dataset_id}.{breakout_config['final_table']}"
+        po_schema = bq_utils.get_table_schema("po")
+        breakout_schema = bq_utils.get_table_schema("breakout")
+        # Tables are partitioned on their window date so cleanup can drop whole partitions and
+        # the merge into final only touches the partitions a batch covers; clustering on
+        # record_key lets the merge's key lookups read only the matching blocks
+        tasks = [
+            (f"{DEFAULT_PROJECT}.{dataset_id}.{po_config['staging_table']}", po_schema, po_config['date_column']),
+            (f"{DEFAULT_PROJECT}.{dataset_id}.{po_config['final_table']}", po_schema, po_config['date_column']),
+            (f"{DEFAULT_PROJECT}.{dataset_id}.{breakout_config['staging_table']}", breakout_schema, breakout_config['date_column']),
+            (f"{DEFAULT_PROJECT}.{dataset_id}.{breakout_config['final_table']}", breakout_schema, breakout_config['date_column']),
+        ]
+
+        # Each create is an independent REST round-trip, so issue them concurrently
+        succeeded = set()
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = {
+                executor.submit(bq_utils.create_table_if_not_exists, client, table_id, schema, partition_field,
+                                ("record_key",)): table_id
+                for table_id, schema, partition_field in tasks
+            }
+            for future in as_completed(futures):
+                table_id = futures[future]
+                try:
+                    future.result()
+                    succeeded.add(table_id)
+                except Exception as e:
+                    logger.error(f"Error creating table {table_id}: {e}")
 
-        for table_id in [breakout_staging_id, breakout_final_id]:
-            try:
-                schema = bq_utils.get_table_schema("breakout")
-                bq_utils.create_table_if_not_exists(client, table_id, schema)
-                created_tables.append(table_id)
-            except Exception as e:
-                logger.error(f"Error creating table {table_id}: {e}")
+        created_tables = [table_id for table_id, _, _ in tasks if table_id in succeeded]
 
-        return jsonify({
+        return _json({
             "status": "success",
             "created_tables": created_tables
         })
 
     except Exception as e:
         logger.error(f"Error creating tables: {str(e)}")
-        return jsonify({
+        return _json({
             "status": "error",
             "error": str(e)
-        }), 500
+        }, 500)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file
@@ -1,6 +1,9 @@
 import os
 import sys
 import logging
+from functools import lru_cache
+from types import MappingProxyType
+import numpy as np
 import pandas as pd
 from datetime import date, timedelta
 
@@ -14,8 +17,11 @@ logger = logging.getLogger(__name__)
 DEFAULT_STAGING = os.environ.get("BQ_BREAKOUT_STAGING_TABLE", "po_breakout_staging")
 DEFAULT_FINAL = os.environ.get("BQ_BREAKOUT_FINAL_TABLE", "po_breakout_final")
 
-BREAKOUT_QUERY_SQL = """
-WITH ParentPOs AS (
+# Optional DB2 MQT (e.g. ITMDATADDL.PO_PARENT_MQT) holding the parent PO rows; see PARENT_MQT_DDL
+BREAKOUT_PARENT_MQT = os.environ.get("BREAKOUT_PARENT_MQT", "")
+
+# Parent POs in the date window, read live from the PO tables
+PARENT_POS_SQL = """
     SELECT DISTINCT
         PH.PO#,
         PH."PO#MAN",
@@ -31,122 +37,110 @@ WITH ParentPOs AS (
       AND PH.POCODE IN ('O','D')
       AND PT.TYPE = 'P'
       AND PH."PO#MAN" IS NOT NULL AND TRIM(PH."PO#MAN") <> ''
-),
+"""
+
+# Parent POs in the date window, read from the MQT (only the columns the CTEs below use)
+PARENT_POS_FROM_MQT_SQL = """
+    SELECT "PO#MAN", POSTR#, DATEEXP
+    FROM {mqt}
+    WHERE DATEEXP BETWEEN :START_DATE AND :END_DATE
+"""
+
+# One-time DDL for the MQT (refresh nightly with: REFRESH TABLE <mqt>). It keeps every parent
+# PO#MAN/store/date, so the date window is still applied per request and results are unchanged
+PARENT_MQT_DDL = """
+CREATE TABLE {mqt} AS (
+    SELECT DISTINCT PH."PO#MAN", PH.POSTR#, PH.DATEEXP
+    FROM "ITM.DATA".POHDR PH
+    JOIN ITMDATADDL.POTYPEF PT  ON PT.PO = PH.PO#
+    JOIN "ITMDATADDL".PODTL PD  ON PD.PO# = PT.PO
+    WHERE PH.POSTR# IN ('118','618','114','614','116','616','110')
+      AND PH.POCODE IN ('O','D')
+      AND PT.TYPE = 'P'
+      AND PH."PO#MAN" IS NOT NULL AND TRIM(PH."PO#MAN") <> ''
+)
+DATA INITIALLY DEFERRED REFRESH DEFERRED MAINTAINED BY USER
+"""
 
--- Distinct parent stores per PO#MAN (avoid duplicates in listagg)
-ParentStores AS (
-    SELECT DISTINCT "PO#MAN", POSTR#
-    FROM ParentPOs
+BREAKOUT_QUERY_SQL = """
+WITH ParentPOs AS (
+:PARENT_POS
 ),
 
--- Parent Exp Date + concatenated Parent Stores per PO#MAN
+-- Parent Exp Date + concatenated Parent Stores per PO#MAN, in one pass over ParentPOs
+-- (the inner GROUP BY leaves one row per store, so the listagg has no duplicates)
 ParentByMan AS (
-    SELECT
-        E."PO#MAN",
-        E.ParentExpDate,
-        S.ParentStores
+    SELECT "PO#MAN",
+           MAX(StoreExpDate) AS ParentExpDate,
+           LISTAGG(CAST(POSTR# AS VARCHAR(10)), ', ') WITHIN GROUP (ORDER BY POSTR#) AS ParentStores
     FROM (
-        SELECT "PO#MAN", MAX(DATEEXP) AS ParentExpDate
+        SELECT "PO#MAN", POSTR#, MAX(DATEEXP) AS StoreExpDate
         FROM ParentPOs
-        GROUP BY "PO#MAN"
-    ) E
-    LEFT JOIN (
-        SELECT "PO#MAN",
-               LISTAGG(CAST(POSTR# AS VARCHAR(10)), ', ') WITHIN GROUP (ORDER BY POSTR#) AS ParentStores
-        FROM ParentStores
-        GROUP BY "PO#MAN"
-    ) S ON S."PO#MAN" = E."PO#MAN"
+        GROUP BY "PO#MAN", POSTR#
+    ) S
+    GROUP BY "PO#MAN"
 ),
 
--- Children (breakouts): no DATEEXP filter; only those tied to Parent PO#MANs
+-- Children (breakouts): no DATEEXP filter; only those tied to Parent PO#MANs (ParentByMan
+-- has one row per PO#MAN, so the inner join is a plain semi-join). Grouped on ids only; the
+-- SKU and vendor descriptions are joined back onto the grouped rows below
 ChildPOs AS (
     SELECT
         PH.PO#MAN,
         PH.POSTR#,
-        SK.SS#,
-        VM.VENDNAME AS VENDORNAME,
-        SK.SKU#,
-        SK.STYLE,
-        SK.SKUDESC1,
+        PD.SKU#,
         PH.DATESHIP,
         PH.DATEEXP,
         SUM(PD.OOUNIT) AS OOUNIT
     FROM "ITM.DATA".POHDR PH
     JOIN "ITM.DATA".PODTL PD       ON PD.PO# = PH.PO#
-    JOIN "ITM.DATA".SKUFILE SK     ON SK.SKU# = PD.SKU#
-    JOIN ITMDATADDL.VENDMAIN VM    ON SK.VEND#1 = VM.VEND#
     JOIN ITMDATADDL.POTYPEF PT     ON PT.PO = PH.PO#
+    JOIN ParentByMan PM            ON PM."PO#MAN" = PH."PO#MAN"
     WHERE PT.TYPE = 'C'
       AND PH."PO#MAN" IS NOT NULL AND TRIM(PH."PO#MAN") <> ''
-      AND EXISTS (SELECT 1 FROM ParentPOs P WHERE P."PO#MAN" = PH."PO#MAN")
-    GROUP BY PH.PO#MAN, PH.PO#, PH.POSTR#, SK.SS#, VM.VENDNAME,
-             SK.SKU#, SK.STYLE, SK.SKUDESC1, PH.DATESHIP, PH.DATEEXP
+    GROUP BY PH.PO#MAN, PH.PO#, PH.POSTR#, PD.SKU#, PH.DATESHIP, PH.DATEEXP
+),
+
+-- Largest child PO quantity per key and store (the value the client-side pivot keeps), so
+-- only one row per store crosses the wire
+StoreQty AS (
+    SELECT PO#MAN, POSTR#, SKU#, DATESHIP, DATEEXP, MAX(OOUNIT) AS OOUNIT
+    FROM ChildPOs
+    GROUP BY PO#MAN, POSTR#, SKU#, DATESHIP, DATEEXP
 )
 
--- Pivot by store number + include parent exp date and parent stores
+-- One row per key and store; the store quantity columns are pivoted client-side (pivot_store_quantities)
 SELECT
     A.PO#MAN     AS "PO#MAN",
-    A.SS#        AS "SS#",
-    A.VENDORNAME AS "VENDOR",
+    SK.SS#       AS "SS#",
+    VM.VENDNAME  AS "VENDOR",
     A.SKU#       AS "SKU#",
-    A.STYLE      AS "STYLE",
-    A.SKUDESC1   AS "SKUDESC",
+    SK.STYLE     AS "STYLE",
+    SK.SKUDESC1  AS "SKUDESC",
     A.DATESHIP   AS "SHIP_DATE",
     A.DATEEXP    AS "EXP_DATE",
     PBM.ParentExpDate AS "Parent Exp Date",
     PBM.ParentStores  AS "Parent Stores",
-
-    COALESCE(MAX(CASE WHEN A.POSTR# = 6   THEN A.OOUNIT END), 0) AS DS,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 16  THEN A.OOUNIT END), 0) AS SH,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 20  THEN A.OOUNIT END), 0) AS MO,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 22  THEN A.OOUNIT END), 0) AS CS,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 24  THEN A.OOUNIT END), 0) AS MI,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 26  THEN A.OOUNIT END), 0) AS CH,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 28  THEN A.OOUNIT END), 0) AS TU,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 30  THEN A.OOUNIT END), 0) AS MB,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 38  THEN A.OOUNIT END), 0) AS WI,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 40  THEN A.OOUNIT END), 0) AS EA,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 44  THEN A.OOUNIT END), 0) AS IC,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 48  THEN A.OOUNIT END), 0) AS SF,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 50  THEN A.OOUNIT END), 0) AS SM,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 54  THEN A.OOUNIT END), 0) AS AP,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 56  THEN A.OOUNIT END), 0) AS SC,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 58  THEN A.OOUNIT END), 0) AS OM,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 60  THEN A.OOUNIT END), 0) AS DM,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 62  THEN A.OOUNIT END), 0) AS RH,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 64  THEN A.OOUNIT END), 0) AS FA,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 70  THEN A.OOUNIT END), 0) AS GF,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 72  THEN A.OOUNIT END), 0) AS KI,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 74  THEN A.OOUNIT END), 0) AS RS,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 76  THEN A.OOUNIT END), 0) AS RC,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 78  THEN A.OOUNIT END), 0) AS SP,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 80  THEN A.OOUNIT END), 0) AS SS,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 82  THEN A.OOUNIT END), 0) AS CF,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 84  THEN A.OOUNIT END), 0) AS GK,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 86  THEN A.OOUNIT END), 0) AS BL,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 88  THEN A.OOUNIT END), 0) AS OP,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 90  THEN A.OOUNIT END), 0) AS RO,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 92  THEN A.OOUNIT END), 0) AS JO,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 94  THEN A.OOUNIT END), 0) AS LI,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 96  THEN A.OOUNIT END), 0) AS TC,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 98  THEN A.OOUNIT END), 0) AS EN,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 110 THEN A.OOUNIT END), 0) AS SD,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 114 THEN A.OOUNIT END), 0) AS FFC,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 116 THEN A.OOUNIT END), 0) AS IP,
-    COALESCE(MAX(CASE WHEN A.POSTR# = 118 THEN A.OOUNIT END), 0) AS "Sidney",
-    COALESCE(MAX(CASE WHEN A.POSTR# = 614 THEN A.OOUNIT END), 0) AS "FFC WEB",
-    COALESCE(MAX(CASE WHEN A.POSTR# = 616 THEN A.OOUNIT END), 0) AS "IP WEB",
-    COALESCE(MAX(CASE WHEN A.POSTR# = 618 THEN A.OOUNIT END), 0) AS "Sidney WEB"
-FROM ChildPOs A
+    A.POSTR#     AS "POSTR#",
+    A.OOUNIT     AS "OOUNIT",
+    CONCAT(CONCAT(CONCAT(CONCAT(A.PO#MAN, '_'), A.SKU#), '_'),
+           COALESCE(VARCHAR_FORMAT(A.DATEEXP, 'YYYYMMDD'), 'NULL')) AS record_key
+FROM StoreQty A
+JOIN "ITM.DATA".SKUFILE SK     ON SK.SKU# = A.SKU#
+JOIN ITMDATADDL.VENDMAIN VM    ON SK.VEND#1 = VM.VEND#
 LEFT JOIN ParentByMan PBM
   ON PBM."PO#MAN" = A.PO#MAN
-GROUP BY
-    A.PO#MAN, A.SS#, A.VENDORNAME, A.SKU#, A.STYLE,
-    A.SKUDESC1, A.DATEEXP, A.DATESHIP, PBM.ParentExpDate, PBM.ParentStores
-ORDER BY A.PO#MAN ASC, A.SS# ASC, A.VENDORNAME ASC, A.SKU# ASC
 FOR READ ONLY WITH UR
 """
 
+def build_breakout_query(parent_mqt=BREAKOUT_PARENT_MQT):
+    """Return the breakout query, reading parent POs from the MQT when one is configured"""
+    if parent_mqt:
+        parent_pos = PARENT_POS_FROM_MQT_SQL.format(mqt=parent_mqt)
+    else:
+        parent_pos = PARENT_POS_SQL
+    return BREAKOUT_QUERY_SQL.replace(':PARENT_POS', parent_pos.strip('\n'))
+
 def fetch_breakout_data(start_date=None, end_date=None, mock_mode=False, use_rolling_window=True):
     """
     Fetch breakout data from DB2.
@@ -164,130 +158,151 @@ def fetch_breakout_data(start_date=None, end_date=None, mock_mode=False, use_rol
     start_date, end_date = db_utils.get_date_range(use_rolling_window, start_date, end_date)
 
     # Execute query
-    df = db_utils.execute_query(BREAKOUT_QUERY_SQL, start_date, end_date)
+    df = db_utils.execute_query(build_breakout_query(), start_date, end_date)
 
-    # Rename columns to match BigQuery schema (remove special characters)
+    # Rename columns to match BigQuery schema (remove special characters), then pivot the stores
     if not df.empty:
         logger.info("Renaming columns for BigQuery compatibility")
-        # First rename the special character columns
-        df = df.rename(columns={
-            'po#man': 'po_man',
-            'ss#': 'ss_num',
-            'vendor': 'vendor',
-            'sku#': 'sku_num',
-            'style': 'style',
-            'skudesc': 'skudesc',
-            'ship_date': 'ship_date',
-            'exp_date': 'exp_date',
-            'parent exp date': 'parent_exp_date',
-            'parent stores': 'parent_stores',
-            'ffc web': 'FFC_WEB',
-            'ip web': 'IP_WEB',
-            'sidney web': 'Sidney_WEB'
-        })
+        df.columns = [BREAKOUT_RENAME.get(col, col) for col in df.columns]
+        # Each step updates the frame it is handed; only the pivot allocates a new one.
+        # Categorize after the pivot: grouping on categoricals would expand to every category combination
+        df = (df.pipe(pivot_store_quantities)
+                .pipe(_ensure_record_key)
+                .pipe(db_utils.to_categorical, BREAKOUT_CATEGORICAL_COLUMNS))
 
-        # Then rename store columns to uppercase to match BigQuery schema
-        store_rename = {
-            'ds': 'DS', 'sh': 'SH', 'mo': 'MO', 'cs': 'CS', 'mi': 'MI', 'ch': 'CH',
-            'tu': 'TU', 'mb': 'MB', 'wi': 'WI', 'ea': 'EA', 'ic': 'IC', 'sf': 'SF',
-            'sm': 'SM', 'ap': 'AP', 'sc': 'SC', 'om': 'OM', 'dm': 'DM', 'rh': 'RH',
-            'fa': 'FA', 'gf': 'GF', 'ki': 'KI', 'rs': 'RS', 'rc': 'RC', 'sp': 'SP',
-            'ss': 'SS', 'cf': 'CF', 'gk': 'GK', 'bl': 'BL', 'op': 'OP', 'ro': 'RO',
-            'jo': 'JO', 'li': 'LI', 'tc': 'TC', 'en': 'EN', 'sd': 'SD', 'ffc': 'FFC',
-            'ip': 'IP', 'sidney': 'Sidney'
-        }
-        df = df.rename(columns=store_rename)
+    return df
 
-        # Generate record_key
+def _ensure_record_key(df):
+    """record_key comes from the DB2 SQL; derive it only for result sets without one"""
+    if 'record_key' not in df.columns:
         logger.info("Generating record_key for breakout data")
-        df['record_key'] = df.apply(generate_breakout_record_key, axis=1)
-
+        df['record_key'] = generate_breakout_record_keys(df)
     return df
 
+def pivot_store_quantities(df):
+    """
+    Pivot one-row-per-store breakout rows into one row per key with a column per store.
+
+    Matches the former SQL pivot: each store column is the MAX of its OOUNIT (0 when the
+    store has no quantity), and keys whose stores are all unlisted still get a row of zeros.
+    """
+    keys = [col for col in BREAKOUT_KEY_COLUMNS if col in df.columns]
+    grouped = df.groupby(keys, dropna=False, sort=True)
+    group_ids = grouped.ngroup().to_numpy()
+    out = grouped.size().index.to_frame(index=False)
+
+    store_pos = {store: pos for pos, store in enumerate(STORE_COLUMNS)}
+    col_ids = (pd.to_numeric(df['postr#'], errors='coerce').map(STORE_NUMBERS).map(store_pos)
+               .fillna(-1).to_numpy(dtype='int64'))
+    qty = pd.to_numeric(df['oounit'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+    matrix = np.full((len(out), len(STORE_COLUMNS)), -np.inf)
+    listed = col_ids >= 0
+    np.fmax.at(matrix, (group_ids[listed], col_ids[listed]), qty[listed])
+    matrix[~np.isfinite(matrix)] = 0
+
+    # OOUNIT is a unit count, so int32 holds it at half the width of int64
+    stores = pd.DataFrame(matrix.astype('int32'), columns=list(STORE_COLUMNS))
+    return pd.concat([out, stores], axis=1, copy=False)
+
+# Mock rows, built once at import; date columns hold day offsets from today (see get_mock_data)
+_MOCK_BREAKOUT_BASE = pd.DataFrame({
+    'po_man': ['PM001', 'PM002', 'PM003'],
+    'ss_num': ['SS1', 'SS2', 'SS3'],
+    'vendor': ['VENDOR1', 'VENDOR2', 'VENDOR3'],
+    'sku_num': ['SKU001', 'SKU002', 'SKU003'],
+    'style': ['STY001', 'STY002', 'STY003'],
+    'skudesc': ['Child Desc 1', 'Child Desc 2', 'Child Desc 3'],
+    'ship_date': [-5, -5, -5],
+    'exp_date': [0, 1, 2],
+    'parent_exp_date': [0, 1, 2],
+    'parent_stores': ['110, 114', '110, 614', '116'],
+    # Store columns (all defaulting to 0 except a few with values) - uppercase to match BQ schema
+    'DS': [0, 0, 0], 'SH': [0, 0, 0], 'MO': [0, 0, 0], 'CS': [0, 0, 0],
+    'MI': [0, 0, 0], 'CH': [0, 0, 0], 'TU': [0, 0, 0], 'MB': [0, 0, 0],
+    'WI': [0, 0, 0], 'EA': [0, 0, 0], 'IC': [0, 0, 0], 'SF': [0, 0, 0],
+    'SM': [0, 0, 0], 'AP': [0, 0, 0], 'SC': [0, 0, 0], 'OM': [0, 0, 0],
+    'DM': [0, 0, 0], 'RH': [0, 0, 0], 'FA': [0, 0, 0], 'GF': [0, 0, 0],
+    'KI': [0, 0, 0], 'RS': [0, 0, 0], 'RC': [0, 0, 0], 'SP': [0, 0, 0],
+    'SS': [0, 0, 0], 'CF': [0, 0, 0], 'GK': [0, 0, 0], 'BL': [0, 0, 0],
+    'OP': [0, 0, 0], 'RO': [0, 0, 0], 'JO': [0, 0, 0], 'LI': [0, 0, 0],
+    'TC': [0, 0, 0], 'EN': [0, 0, 0],
+    'SD': [50, 100, 0],  # Store 110
+    'FFC': [75, 0, 0],   # Store 114
+    'IP': [0, 0, 150],   # Store 116
+    'Sidney': [0, 0, 0], # Store 118
+    'FFC_WEB': [0, 125, 0], # Store 614
+    'IP_WEB': [0, 0, 0],    # Store 616
+    'Sidney_WEB': [0, 0, 0], # Store 618
+    'record_key': ['', '', '']
+})
+_MOCK_BREAKOUT_DATE_COLUMNS = ('ship_date', 'exp_date', 'parent_exp_date')
+
 def get_mock_data(start_date, end_date):
     """Generate mock data for testing"""
     logger.info(f"Generating mock breakout data for date range: {start_date} to {end_date}")
     today = date.today()
-    # Create pivoted format matching new query structure with BQ-compatible column names
-    data = pd.DataFrame({
-        'po_man': ['PM001', 'PM002', 'PM003'],
-        'ss_num': ['SS1', 'SS2', 'SS3'],
-        'vendor': ['VENDOR1', 'VENDOR2', 'VENDOR3'],
-        'sku_num': ['SKU001', 'SKU002', 'SKU003'],
-        'style': ['STY001', 'STY002', 'STY003'],
-        'skudesc': ['Child Desc 1', 'Child Desc 2', 'Child Desc 3'],
-        'ship_date': [today - timedelta(days=5)] * 3,
-        'exp_date': [today, today + timedelta(days=1), today + timedelta(days=2)],
-        'parent_exp_date': [today, today + timedelta(days=1), today + timedelta(days=2)],
-        'parent_stores': ['110, 114', '110, 614', '116'],
-        # Store columns (all defaulting to 0 except a few with values) - uppercase to match BQ schema
-        'DS': [0, 0, 0], 'SH': [0, 0, 0], 'MO': [0, 0, 0], 'CS': [0, 0, 0],
-        'MI': [0, 0, 0], 'CH': [0, 0, 0], 'TU': [0, 0, 0], 'MB': [0, 0, 0],
-        'WI': [0, 0, 0], 'EA': [0, 0, 0], 'IC': [0, 0, 0], 'SF': [0, 0, 0],
-        'SM': [0, 0, 0], 'AP': [0, 0, 0], 'SC': [0, 0, 0], 'OM': [0, 0, 0],
-        'DM': [0, 0, 0], 'RH': [0, 0, 0], 'FA': [0, 0, 0], 'GF': [0, 0, 0],
-        'KI': [0, 0, 0], 'RS': [0, 0, 0], 'RC': [0, 0, 0], 'SP': [0, 0, 0],
-        'SS': [0, 0, 0], 'CF': [0, 0, 0], 'GK': [0, 0, 0], 'BL': [0, 0, 0],
-        'OP': [0, 0, 0], 'RO': [0, 0, 0], 'JO': [0, 0, 0], 'LI': [0, 0, 0],
-        'TC': [0, 0, 0], 'EN': [0, 0, 0],
-        'SD': [50, 100, 0],  # Store 110
-        'FFC': [75, 0, 0],   # Store 114
-        'IP': [0, 0, 150],   # Store 116
-        'Sidney': [0, 0, 0], # Store 118
-        'FFC_WEB': [0, 125, 0], # Store 614
-        'IP_WEB': [0, 0, 0],    # Store 616
-        'Sidney_WEB': [0, 0, 0], # Store 618
-        'record_key': [
-            f"PM001_SKU001_{today.strftime('%Y%m%d')}",
-            f"PM002_SKU002_{(today + timedelta(days=1)).strftime('%Y%m%d')}",
-            f"PM003_SKU003_{(today + timedelta(days=2)).strftime('%Y%m%d')}"
-        ]
-    })
+    # Pivoted format matching the query output with BQ-compatible column names
+    data = _MOCK_BREAKOUT_BASE.copy()
+    for col in _MOCK_BREAKOUT_DATE_COLUMNS:
+        data[col] = [today + timedelta(days=offset) for offset in _MOCK_BREAKOUT_BASE[col].tolist()]
+    data['record_key'] = generate_breakout_record_keys(data)
     return data
 
-def generate_breakout_record_key(row):
-    """Generate unique record key for breakout data"""
-    po_man = row.get('po_man', '')
-    sku = row.get('sku_num', '')
-    exp_date = row.get('exp_date')
-    if pd.notna(exp_date):
-        exp_date_str = exp_date.strftime('%Y%m%d') if hasattr(exp_date, 'strftime') else str(exp_date).replace('-', '')
-    else:
-        exp_date_str = 'NULL'
-    return f"{po_man}_{sku}_{exp_date_str}"
-
-def get_breakout_config():
-    """Return configuration for breakout query"""
-    # Define all store columns
-    store_columns = [
-        'DS', 'SH', 'MO', 'CS', 'MI', 'CH', 'TU', 'MB', 'WI', 'EA', 'IC', 'SF',
-        'SM', 'AP', 'SC', 'OM', 'DM', 'RH', 'FA', 'GF', 'KI', 'RS', 'RC', 'SP',
-        'SS', 'CF', 'GK', 'BL', 'OP', 'RO', 'JO', 'LI', 'TC', 'EN', 'SD', 'FFC',
-        'IP', 'Sidney', 'FFC WEB', 'IP WEB', 'Sidney WEB'
-    ]
+def generate_breakout_record_keys(df):
+    """Generate record keys for a whole breakout DataFrame"""
+    return db_utils.build_record_key(df, BREAKOUT_RECORD_KEY_COLUMNS, 'exp_date')
 
-    # Update store columns to match BQ naming (uppercase to match BigQuery schema)
-    store_columns = [
-        'DS', 'SH', 'MO', 'CS', 'MI', 'CH', 'TU', 'MB', 'WI', 'EA', 'IC', 'SF',
-        'SM', 'AP', 'SC', 'OM', 'DM', 'RH', 'FA', 'GF', 'KI', 'RS', 'RC', 'SP',
-        'SS', 'CF', 'GK', 'BL', 'OP', 'RO', 'JO', 'LI', 'TC', 'EN', 'SD', 'FFC',
-        'IP', 'Sidney', 'FFC_WEB', 'IP_WEB', 'Sidney_WEB'
-    ]
+# Store columns, named as in BigQuery (all integers)
+STORE_COLUMNS = (
+    'DS', 'SH', 'MO', 'CS', 'MI', 'CH', 'TU', 'MB', 'WI', 'EA', 'IC', 'SF',
+    'SM', 'AP', 'SC', 'OM', 'DM', 'RH', 'FA', 'GF', 'KI', 'RS', 'RC', 'SP',
+    'SS', 'CF', 'GK', 'BL', 'OP', 'RO', 'JO', 'LI', 'TC', 'EN', 'SD', 'FFC',
+    'IP', 'Sidney', 'FFC_WEB', 'IP_WEB', 'Sidney_WEB'
+)
+# DB2 result column → BigQuery column (special characters removed); read-only module constants
+BREAKOUT_RENAME = MappingProxyType({
+    'po#man': 'po_man',
+    'ss#': 'ss_num',
+    'sku#': 'sku_num',
+    'parent exp date': 'parent_exp_date',
+    'parent stores': 'parent_stores'
+})
+# POSTR# → store column
+STORE_NUMBERS = MappingProxyType(dict(zip(
+    (6, 16, 20, 22, 24, 26, 28, 30, 38, 40, 44, 48, 50, 54, 56, 58, 60, 62, 64, 70, 72,
+     74, 76, 78, 80, 82, 84, 86, 88, 90, 92, 94, 96, 98, 110, 114, 116, 118, 614, 616, 618),
+    STORE_COLUMNS
+)))
+# Columns identifying one breakout row (one row per key, one quantity column per store)
+BREAKOUT_KEY_COLUMNS = ('po_man', 'ss_num', 'vendor', 'sku_num', 'style', 'skudesc', 'ship_date', 'exp_date',
+                        'parent_exp_date', 'parent_stores', 'record_key')
+# Key columns of '<po_man>_<sku_num>_<exp_date YYYYMMDD>' record keys
+BREAKOUT_RECORD_KEY_COLUMNS = ('po_man', 'sku_num')
+# Column typing for the BigQuery load (constant, so built once)
+BREAKOUT_DATE_COLUMNS = ('ship_date', 'exp_date', 'parent_exp_date')
+BREAKOUT_STRING_COLUMNS = ('po_man', 'ss_num', 'vendor', 'sku_num', 'style', 'skudesc', 'parent_stores', 'record_key')
+# Low-cardinality text columns held as categoricals between fetch and load
+BREAKOUT_CATEGORICAL_COLUMNS = ('vendor', 'style', 'po_man', 'parent_stores')
+BREAKOUT_COLUMNS = (('po_man', 'ss_num', 'vendor', 'sku_num', 'style', 'skudesc', 'ship_date', 'exp_date',
+                     'parent_exp_date', 'parent_stores') + STORE_COLUMNS + ('record_key', 'load_timestamp'))
 
-    return {
+@lru_cache(maxsize=1)
+def get_breakout_config():
+    """Return configuration for breakout query (built once and shared, hence read-only)"""
+    return MappingProxyType({
         'staging_table': DEFAULT_STAGING,
         'final_table': DEFAULT_FINAL,
-        'integer_columns': store_columns,  # All store columns are integers
-        'date_columns': ['ship_date', 'exp_date', 'parent_exp_date'],
-        'string_columns': ['po_man', 'ss_num', 'vendor', 'sku_num', 'style', 'skudesc', 'parent_stores', 'record_key'],
-        'columns': ['po_man', 'ss_num', 'vendor', 'sku_num', 'style', 'skudesc', 'ship_date', 'exp_date',
-                   'parent_exp_date', 'parent_stores'] + store_columns + ['record_key', 'load_timestamp'],
-        'generate_record_key': generate_breakout_record_key,
+        'integer_columns': STORE_COLUMNS,
+        'date_columns': BREAKOUT_DATE_COLUMNS,
+        'string_columns': BREAKOUT_STRING_COLUMNS,
+        'columns': BREAKOUT_COLUMNS,
+        'record_key_columns': BREAKOUT_RECORD_KEY_COLUMNS,
         'merge_order_by': 'load_timestamp DESC, exp_date DESC',
         'date_column': 'exp_date',
-        'days_back': 30,
-        'days_forward': 60,
+        'days_back': db_utils.ROLLING_DAYS_BACK,
+        'days_forward': db_utils.ROLLING_DAYS_FORWARD,
         'cleanup_staging': True,
         'cleanup_final': True,
         'cleanup_stale': True
-    }
\ No newline at end of file
+    })
\ No newline at end of file
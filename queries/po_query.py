@@ -1,8 +1,11 @@
 import os
 import sys
 import logging
+from functools import lru_cache
+from types import MappingProxyType
 import pandas as pd
 from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -14,14 +17,23 @@ logger = logging.getLogger(__name__)
 DEFAULT_STAGING = os.environ.get("BQ_STAGING_TABLE", "po_inbound_daily")
 DEFAULT_FINAL = os.environ.get("BQ_FINAL_TABLE", "po_inbound_final")
 
+# PO stores (POSTR#) covered by the query
+PO_STORES = ('110', '114', '614', '116', '616', '118', '618')
+# Fetch each store as its own query on its own connection, in parallel
+PO_SHARD_BY_STORE = os.environ.get("PO_SHARD_BY_STORE", "0") == "1"
+PO_SHARD_WORKERS = int(os.environ.get("PO_SHARD_WORKERS", str(len(PO_STORES))))
+# Rows per batch when PO data is streamed to BigQuery
+PIPELINE_BATCH_ROWS = int(os.environ.get("PIPELINE_BATCH_ROWS", "20000"))
+
 PO_QUERY_SQL = """
-WITH LatestDate AS (
+WITH WindowPOs AS (
+    -- POs FirstQuery can return; the breakout subqueries below only aggregate their PO#MANs
     SELECT
-        PH.PO#,
-        MAX(PH.DATERCV) AS DateRCV
-    FROM "ITMDATADDL".PURHSTHDR PH
-    WHERE PH.STR# IN ('110','114','614','116','616','118','618')
-    GROUP BY PH.PO#
+        WP."PO#MAN"
+    FROM "ITM.DATA".POHDR WP
+    WHERE WP.POSTR# IN (:PO_STORES)
+      AND WP.DATEEXP BETWEEN :START_DATE AND :END_DATE
+      AND WP.POCODE IN ('O','D')
 ),
 
 FirstQuery AS (
@@ -36,7 +48,6 @@ FirstQuery AS (
         SK.SKU#,
         SK.STYLE,
         SK.SKUDESC1,
-        MAX(LD.DateRCV) AS LATEST_DATERCV,
         PH.DATEEXP AS EXPECTED_DATE,
         PH.DATECANC AS CANCEL_DATE,
         SUM(PD.OOUNIT) AS OOQTY,
@@ -46,8 +57,7 @@ FirstQuery AS (
     JOIN ITMDATADDL.PODTL PD ON PD.PO# = PH.PO#
     JOIN ITMDATADDL.SKUFILE SK ON SK.SKU# = PD.SKU#
     JOIN ITMDATADDL.VENDMAIN VM ON SK.VEND#1 = VM.VEND#
-    LEFT JOIN LatestDate LD ON PD.PO# = LD.PO#
-    WHERE PH.POSTR# IN ('110','114','614','116','616','118','618')
+    WHERE PH.POSTR# IN (:PO_STORES)
       AND PH.DATEEXP BETWEEN :START_DATE AND :END_DATE
       AND PH.POCODE IN ('O','D')
       AND PT.TYPE IN ('P','R')
@@ -89,14 +99,18 @@ SELECT
     FQ.SKUDESC1 AS skudesc1,
     FQ.EXPECTED_DATE AS expected_date,
     FQ.CANCEL_DATE AS cancel_date,
-    FQ.OOQTY AS ooqty,
-    FQ.RCVDQTY AS rcvdqty,
+    COALESCE(FQ.OOQTY, 0) AS ooqty,
+    COALESCE(FQ.RCVDQTY, 0) AS rcvdqty,
     COALESCE(SQ.BREAKOUTQTY, 0) AS breakoutqty,
     COALESCE(SQ.Allocated, 0) AS allocated,
     COALESCE(InvoiceSum.UNITINVC_PER_SKU, 0) AS unitinvc_per_sku,
     A.SKU AS shipped_sku,
     COALESCE(A.ASN_QTY, 0) AS shipped_qty,
-    FQ.LATEST_DATERCV AS latest_datercv,
+    -- Latest receipt per PO: an indexed PURHSTHDR (PO#, STR#) lookup instead of a grouped join
+    (SELECT MAX(RH.DATERCV)
+       FROM "ITMDATADDL".PURHSTHDR RH
+      WHERE RH.PO# = FQ.PO#
+        AND RH.STR# IN ('110','114','614','116','616','118','618')) AS latest_datercv,
     A.SHIPNOTICE_DATE AS shipnotice_date,
     CONCAT(CONCAT(CONCAT(CONCAT(FQ.PO#, '_'), FQ.SKU#), '_'), VARCHAR_FORMAT(FQ.EXPECTED_DATE, 'YYYYMMDD')) AS record_key
 
@@ -125,6 +139,7 @@ LEFT JOIN (
         JOIN ITMDATADDL.PODTL PD ON PD."PO#" = PH.PO#
         JOIN ITMDATADDL.SKUFILE SK ON SK.SKU# = PD.SKU#
         WHERE PH."PO#MAN" IS NOT NULL AND TRIM(PH."PO#MAN") <> ''
+          AND PH."PO#MAN" IN (SELECT "PO#MAN" FROM WindowPOs)
         GROUP BY PH."PO#MAN", PD.SKU#
     ) A
     LEFT JOIN (
@@ -137,6 +152,7 @@ LEFT JOIN (
         JOIN ITMDATADDL.SKUFILE SK ON AD.SKU = SK.SKU#
         JOIN ITMDATADDL.POHDR PH ON SWIM."PO#" = PH.PO#
         WHERE PH."PO#MAN" IS NOT NULL AND TRIM(PH."PO#MAN") <> ''
+          AND PH."PO#MAN" IN (SELECT "PO#MAN" FROM WindowPOs)
         GROUP BY PH."PO#MAN", AD.SKU
     ) AD ON A."PO#MAN" = AD."PO#MAN" AND A.SKU# = AD.SKU
     GROUP BY A."PO#MAN", A.SKU#
@@ -148,6 +164,48 @@ ORDER BY FQ.PO#, FQ.SKU#, A.SHIPNOTICE_DATE
 FOR READ ONLY WITH UR
 """
 
+# One-time DB2 for i indexes (equality columns first, any range column after them, then the
+# selected columns as trailing keys so the index covers the read). The queries read POHDR and
+# PODTL through both schemas, so each schema gets its own:
+#   "ITM.DATA".POHDR     - the POSTR#/POCODE/DATEEXP window filter (PO WindowPOs/FQ, breakout CTEs)
+#   ITMDATADDL.POHDR     - the PO#MAN lookups in the PO query's breakout/allocation subquery (SQ)
+#   ITMDATADDL.PODTL     - the PO detail join and SQ, breakout ParentPOs
+#   "ITM.DATA".PODTL     - breakout ChildPOs
+#   ITMDATADDL.PURHSTHDR - the latest-receipt lookup
+# IBM i keeps the statistics current itself, so there is no RUNSTATS step. Run each statement
+# once, e.g. from ACS Run SQL Scripts
+PO_INDEX_DDL = (
+    'CREATE INDEX ITMDATADDL.IX_POHDR_FILTER ON "ITM.DATA".POHDR (POSTR#, POCODE, DATEEXP, PO#, "PO#MAN", DATESHIP)',
+    'CREATE INDEX ITMDATADDL.IX_POHDR_POMAN ON ITMDATADDL.POHDR ("PO#MAN", PO#)',
+    'CREATE INDEX ITMDATADDL.IX_POTYPEF_TYPE ON ITMDATADDL.POTYPEF (TYPE, PO)',
+    'CREATE INDEX ITMDATADDL.IX_PODTL_PO ON ITMDATADDL.PODTL (PO#, SKU#, OOUNIT, RCUNIT)',
+    'CREATE INDEX ITMDATADDL.IX_ITMDATA_PODTL_PO ON "ITM.DATA".PODTL (PO#, SKU#, OOUNIT, RCUNIT)',
+    'CREATE INDEX ITMDATADDL.IX_PURHSTHDR_PO ON ITMDATADDL.PURHSTHDR (PO#, STR#, DATERCV)',
+)
+
+def build_po_query(stores=PO_STORES):
+    """Return the PO query restricted to the given PO stores, and the store parameters it binds"""
+    params = {f"PO_STORE_{i}": store for i, store in enumerate(stores)}
+    return PO_QUERY_SQL.replace(':PO_STORES', ', '.join(f":{name}" for name in params)), params
+
+def _execute_po_query(stores, start_date, end_date):
+    """Run the PO query for the given stores"""
+    query, params = build_po_query(stores)
+    return db_utils.execute_query(query, start_date, end_date, params=params)
+
+def _fetch_po_shards(start_date, end_date):
+    """Fetch one store per query in parallel and stitch the shards back together"""
+    logger.info(f"Fetching PO data in {len(PO_STORES)} store shards with {PO_SHARD_WORKERS} workers")
+    with ThreadPoolExecutor(max_workers=PO_SHARD_WORKERS) as executor:
+        frames = list(executor.map(
+            lambda store: _execute_po_query((store,), start_date, end_date),
+            PO_STORES
+        ))
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True, copy=False)
+
 def fetch_po_data(start_date=None, end_date=None, mock_mode=False, use_rolling_window=True):
     """
     Fetch PO data from DB2.
@@ -165,77 +223,109 @@ def fetch_po_data(start_date=None, end_date=None, mock_mode=False, use_rolling_w
     start_date, end_date = db_utils.get_date_range(use_rolling_window, start_date, end_date)
 
     # Execute query
-    df = db_utils.execute_query(PO_QUERY_SQL, start_date, end_date)
+    if PO_SHARD_BY_STORE:
+        df = _fetch_po_shards(start_date, end_date)
+    else:
+        df = _execute_po_query(PO_STORES, start_date, end_date)
 
-    # Generate record_key if not present (backward compatibility)
-    if not df.empty and 'record_key' not in df.columns:
-        logger.info("Generating record_key for backward compatibility")
-        df['record_key'] = df.apply(generate_po_record_key, axis=1)
+    # record_key comes from the DB2 SQL; load_to_bigquery only derives it if a column is missing
 
-    return df
+    return db_utils.to_categorical(df, PO_CATEGORICAL_COLUMNS)
+
+def fetch_po_batches(start_date=None, end_date=None, use_rolling_window=True):
+    """
+    Yield PO data from DB2 as DataFrame batches, for pipelined loading.
+
+    With store sharding enabled each store's result is one batch, yielded as soon as
+    its query finishes; otherwise the single query is read PIPELINE_BATCH_ROWS at a time.
+    """
+    start_date, end_date = db_utils.get_date_range(use_rolling_window, start_date, end_date)
+
+    if PO_SHARD_BY_STORE:
+        with ThreadPoolExecutor(max_workers=PO_SHARD_WORKERS) as executor:
+            futures = [
+                executor.submit(_execute_po_query, (store,), start_date, end_date)
+                for store in PO_STORES
+            ]
+            for future in as_completed(futures):
+                yield db_utils.to_categorical(future.result(), PO_CATEGORICAL_COLUMNS)
+        return
+
+    query, params = build_po_query()
+    for batch in db_utils.iter_query_batches(query, start_date, end_date, PIPELINE_BATCH_ROWS, params=params):
+        yield db_utils.to_categorical(batch, PO_CATEGORICAL_COLUMNS)
+
+# Mock rows, built once at import; date columns hold day offsets from today (see get_mock_data)
+_MOCK_PO_BASE = pd.DataFrame({
+    'store': ['110', '114', '614'],
+    'vendor': ['VENDOR1', 'VENDOR2', 'VENDOR3'],
+    'ss': ['SS1', 'SS2', 'SS3'],
+    'type': ['P', 'R', 'P'],
+    'po_code': ['O', 'D', 'O'],
+    'po': ['PO001', 'PO002', 'PO003'],
+    'po_man': ['PM001', 'PM002', 'PM003'],
+    'sku': ['SKU001', 'SKU002', 'SKU003'],
+    'style': ['STY001', 'STY002', 'STY003'],
+    'skudesc1': ['Description 1', 'Description 2', 'Description 3'],
+    'expected_date': [0, 1, 2],
+    'cancel_date': [30, 30, 30],
+    'ooqty': [100, 200, 150],
+    'rcvdqty': [50, 100, 75],
+    'breakoutqty': [10, 20, 15],
+    'allocated': [40, 80, 60],
+    'unitinvc_per_sku': [25, 30, 35],
+    'shipped_sku': ['SKU001', 'SKU002', 'SKU003'],
+    'shipped_qty': [45, 95, 70],
+    'latest_datercv': [-1, -1, -1],
+    'shipnotice_date': [-2, -2, -2],
+    'record_key': ['', '', '']
+})
+_MOCK_PO_DATE_COLUMNS = ('expected_date', 'cancel_date', 'latest_datercv', 'shipnotice_date')
 
 def get_mock_data(start_date, end_date):
     """Generate mock data for testing"""
     logger.info(f"Generating mock PO data for date range: {start_date} to {end_date}")
     today = date.today()
-    data = pd.DataFrame({
-        'store': ['110', '114', '614'],
-        'vendor': ['VENDOR1', 'VENDOR2', 'VENDOR3'],
-        'ss': ['SS1', 'SS2', 'SS3'],
-        'type': ['P', 'R', 'P'],
-        'po_code': ['O', 'D', 'O'],
-        'po': ['PO001', 'PO002', 'PO003'],
-        'po_man': ['PM001', 'PM002', 'PM003'],
-        'sku': ['SKU001', 'SKU002', 'SKU003'],
-        'style': ['STY001', 'STY002', 'STY003'],
-        'skudesc1': ['Description 1', 'Description 2', 'Description 3'],
-        'expected_date': [today, today + timedelta(days=1), today + timedelta(days=2)],
-        'cancel_date': [today + timedelta(days=30)] * 3,
-        'ooqty': [100, 200, 150],
-        'rcvdqty': [50, 100, 75],
-        'breakoutqty': [10, 20, 15],
-        'allocated': [40, 80, 60],
-        'unitinvc_per_sku': [25, 30, 35],
-        'shipped_sku': ['SKU001', 'SKU002', 'SKU003'],
-        'shipped_qty': [45, 95, 70],
-        'latest_datercv': [today - timedelta(days=1)] * 3,
-        'shipnotice_date': [today - timedelta(days=2)] * 3,
-        'record_key': ['PO001_SKU001_' + today.strftime('%Y%m%d'),
-                      'PO002_SKU002_' + (today + timedelta(days=1)).strftime('%Y%m%d'),
-                      'PO003_SKU003_' + (today + timedelta(days=2)).strftime('%Y%m%d')]
-    })
+    data = _MOCK_PO_BASE.copy()
+    for col in _MOCK_PO_DATE_COLUMNS:
+        data[col] = [today + timedelta(days=offset) for offset in _MOCK_PO_BASE[col].tolist()]
+    data['record_key'] = generate_po_record_keys(data)
     return data
 
-def generate_po_record_key(row):
-    """Generate unique record key for PO data"""
-    po = row.get('po', '')
-    sku = row.get('sku', '')
-    exp_date = row.get('expected_date')
-    if pd.notna(exp_date):
-        exp_date_str = exp_date.strftime('%Y%m%d') if hasattr(exp_date, 'strftime') else str(exp_date).replace('-', '')
-    else:
-        exp_date_str = 'NULL'
-    return f"{po}_{sku}_{exp_date_str}"
+def generate_po_record_keys(df):
+    """Generate record keys for a whole PO DataFrame"""
+    return db_utils.build_record_key(df, PO_RECORD_KEY_COLUMNS, 'expected_date')
+
+# Key columns of '<po>_<sku>_<expected_date YYYYMMDD>' record keys
+PO_RECORD_KEY_COLUMNS = ('po', 'sku')
+# Column typing for the BigQuery load (constant, so built once)
+PO_INTEGER_COLUMNS = ('ooqty', 'rcvdqty', 'breakoutqty', 'allocated', 'unitinvc_per_sku', 'shipped_qty')
+PO_DATE_COLUMNS = ('expected_date', 'cancel_date', 'latest_datercv', 'shipnotice_date')
+PO_STRING_COLUMNS = ('store', 'vendor', 'ss', 'type', 'po_code', 'po', 'po_man',
+                     'sku', 'style', 'skudesc1', 'shipped_sku', 'record_key')
+# Low-cardinality text columns held as categoricals between fetch and load
+PO_CATEGORICAL_COLUMNS = ('store', 'vendor', 'type', 'po_code', 'po_man', 'style')
+PO_COLUMNS = ('store', 'vendor', 'ss', 'type', 'po_code', 'po', 'po_man', 'sku', 'style',
+              'skudesc1', 'expected_date', 'cancel_date', 'ooqty', 'rcvdqty', 'breakoutqty',
+              'allocated', 'unitinvc_per_sku', 'shipped_sku', 'shipped_qty', 'latest_datercv',
+              'shipnotice_date', 'record_key', 'load_timestamp')
 
+@lru_cache(maxsize=1)
 def get_po_config():
-    """Return configuration for PO query"""
-    return {
+    """Return configuration for PO query (built once and shared, hence read-only)"""
+    return MappingProxyType({
         'staging_table': DEFAULT_STAGING,
         'final_table': DEFAULT_FINAL,
-        'integer_columns': ['ooqty', 'rcvdqty', 'breakoutqty', 'allocated', 'unitinvc_per_sku', 'shipped_qty'],
-        'date_columns': ['expected_date', 'cancel_date', 'latest_datercv', 'shipnotice_date'],
-        'string_columns': ['store', 'vendor', 'ss', 'type', 'po_code', 'po', 'po_man',
-                          'sku', 'style', 'skudesc1', 'shipped_sku', 'record_key'],
-        'columns': ['store', 'vendor', 'ss', 'type', 'po_code', 'po', 'po_man', 'sku', 'style',
-                   'skudesc1', 'expected_date', 'cancel_date', 'ooqty', 'rcvdqty', 'breakoutqty',
-                   'allocated', 'unitinvc_per_sku', 'shipped_sku', 'shipped_qty', 'latest_datercv',
-                   'shipnotice_date', 'record_key', 'load_timestamp'],
-        'generate_record_key': generate_po_record_key,
+        'integer_columns': PO_INTEGER_COLUMNS,
+        'date_columns': PO_DATE_COLUMNS,
+        'string_columns': PO_STRING_COLUMNS,
+        'columns': PO_COLUMNS,
+        'record_key_columns': PO_RECORD_KEY_COLUMNS,
         'merge_order_by': 'load_timestamp DESC, shipnotice_date DESC, latest_datercv DESC, rcvdqty DESC, ooqty DESC',
         'date_column': 'expected_date',
-        'days_back': 30,
-        'days_forward': 60,
+        'days_back': db_utils.ROLLING_DAYS_BACK,
+        'days_forward': db_utils.ROLLING_DAYS_FORWARD,
         'cleanup_staging': True,
         'cleanup_final': True,
         'cleanup_stale': True
-    }
\ No newline at end of file
+    })
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""Unit tests for the breakout query module (store pivot, mock data)"""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from queries.breakout_query import STORE_COLUMNS, STORE_NUMBERS, get_mock_data, pivot_store_quantities
+
+KEYS = ['po_man', 'sku_num', 'exp_date']
+
+def _rows(*rows):
+    """One-row-per-store breakout rows as the DB2 query returns them"""
+    return pd.DataFrame(rows, columns=KEYS + ['postr#', 'oounit'])
+
+def _sql_pivot(df):
+    """Reference pivot with the former SQL's semantics:
+    COALESCE(MAX(CASE WHEN POSTR# = <store> THEN OOUNIT END), 0) per store, GROUP BY the keys"""
+    out = {}
+    for row in df.itertuples(index=False):
+        key = tuple(None if pd.isna(v) else v for v in row[:len(KEYS)])
+        stores = out.setdefault(key, {})
+        column = STORE_NUMBERS.get(row[len(KEYS)])
+        qty = row[len(KEYS) + 1]
+        if column is not None and not pd.isna(qty):
+            stores[column] = max(stores.get(column, qty), qty)
+    return {key: [stores.get(col, 0) for col in STORE_COLUMNS] for key, stores in out.items()}
+
+def _as_dict(pivoted):
+    """Pivot output keyed like _sql_pivot, for order-independent comparison"""
+    result = {}
+    for row in pivoted.itertuples(index=False):
+        key = tuple(None if pd.isna(v) else v for v in row[:len(KEYS)])
+        result[key] = list(row[len(KEYS):])
+    return result
+
+def test_max_per_store():
+    """Several rows for one key and store keep the largest quantity, including negatives"""
+    out = pivot_store_quantities(_rows(
+        ('PM1', 'SKU1', '2024-01-05', 110, 5),
+        ('PM1', 'SKU1', '2024-01-05', 110, 9),
+        ('PM1', 'SKU1', '2024-01-05', 114, -3),
+        ('PM1', 'SKU1', '2024-01-05', 114, -7),
+    ))
+    assert len(out) == 1
+    assert out.loc[0, 'SD'] == 9
+    assert out.loc[0, 'FFC'] == -3
+    assert (out.drop(columns=KEYS + ['SD', 'FFC']) == 0).all().all()
+
+def test_null_quantity_is_zero():
+    """A NULL OOUNIT counts as no quantity: 0 alone, ignored next to a real value"""
+    out = pivot_store_quantities(_rows(
+        ('PM1', 'SKU1', '2024-01-05', 110, None),
+        ('PM1', 'SKU1', '2024-01-05', 114, None),
+        ('PM1', 'SKU1', '2024-01-05', 114, 4),
+    ))
+    assert out.loc[0, 'SD'] == 0
+    assert out.loc[0, 'FFC'] == 4
+
+def test_unlisted_stores_ignored():
+    """Stores without a column add nothing, but their key still gets a row of zeros"""
+    out = pivot_store_quantities(_rows(
+        ('PM1', 'SKU1', '2024-01-05', 999, 50),
+        ('PM2', 'SKU2', '2024-01-05', 999, 60),
+        ('PM2', 'SKU2', '2024-01-05', 614, 7),
+    ))
+    by_key = _as_dict(out)
+    assert by_key[('PM1', 'SKU1', '2024-01-05')] == [0] * len(STORE_COLUMNS)
+    assert sum(by_key[('PM2', 'SKU2', '2024-01-05')]) == 7
+    assert out.loc[out['po_man'] == 'PM2', 'FFC_WEB'].item() == 7
+
+def test_nan_keys_kept():
+    """Rows with NULL key columns form their own group instead of being dropped"""
+    out = pivot_store_quantities(_rows(
+        ('PM1', 'SKU1', None, 110, 5),
+        ('PM1', 'SKU1', None, 110, 8),
+        ('PM1', 'SKU1', '2024-01-05', 110, 2),
+        (None, 'SKU1', '2024-01-05', 116, 3),
+    ))
+    by_key = _as_dict(out)
+    assert len(by_key) == 3
+    assert by_key[('PM1', 'SKU1', None)][STORE_COLUMNS.index('SD')] == 8
+    assert by_key[(None, 'SKU1', '2024-01-05')][STORE_COLUMNS.index('IP')] == 3
+
+def test_decimal_strings_and_layout():
+    """ibm_db returns DECIMAL as str; output is keys then every store column, as int32"""
+    out = pivot_store_quantities(_rows(('PM1', 'SKU1', '2024-01-05', '110', '12.000')))
+    assert list(out.columns) == KEYS + list(STORE_COLUMNS)
+    assert out.loc[0, 'SD'] == 12
+    assert all(out[col].dtype == np.int32 for col in STORE_COLUMNS)
+
+def test_matches_sql_pivot():
+    """Random rows pivot to the same values the SQL pivot produced"""
+    rng = np.random.default_rng(7)
+    stores = list(STORE_NUMBERS) + [1, 999]
+    n = 2000
+    df = _rows(*zip(
+        rng.choice(['PM1', 'PM2', 'PM3', None], n).tolist(),
+        rng.choice(['SKU1', 'SKU2'], n).tolist(),
+        rng.choice(['2024-01-05', '2024-01-06', None], n).tolist(),
+        rng.choice(stores, n).tolist(),
+        [None if missing else qty for missing, qty in zip(rng.random(n) < 0.1, rng.integers(-5, 500, n).tolist())],
+    ))
+    assert _as_dict(pivot_store_quantities(df)) == _sql_pivot(df)
+
+def test_mock_data():
+    """Mock rows carry dates relative to today and matching record keys; each call is a fresh frame"""
+    today = date.today()
+    first = get_mock_data(None, None)
+    assert first['ship_date'].tolist() == [today - timedelta(days=5)] * 3
+    assert first['exp_date'].tolist() == [today + timedelta(days=d) for d in range(3)]
+    assert first['parent_exp_date'].tolist() == first['exp_date'].tolist()
+    assert first['record_key'].tolist() == [
+        f"PM00{i + 1}_SKU00{i + 1}_{(today + timedelta(days=i)).strftime('%Y%m%d')}" for i in range(3)
+    ]
+    assert first[['SD', 'FFC', 'IP', 'FFC_WEB']].values.tolist() == [[50, 75, 0, 0], [100, 0, 0, 125], [0, 0, 150, 0]]
+
+    first.loc[0, 'SD'] = -1
+    first.loc[0, 'parent_stores'] = 'changed'
+    second = get_mock_data(None, None)
+    assert second.loc[0, 'SD'] == 50
+    assert second.loc[0, 'parent_stores'] == '110, 114'
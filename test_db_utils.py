@@ -0,0 +1,60 @@
+"""Unit tests for the DB2 query helpers that don't need a connection"""
+
+from datetime import date
+
+import pandas as pd
+
+from utils.db_utils import _sqlstate, bind_markers, build_record_key
+
+def test_bind_markers_dates():
+    """:START_DATE / :END_DATE become ? markers with dates bound in marker order"""
+    sql, values = bind_markers(
+        "SELECT 1 FROM T WHERE D BETWEEN :START_DATE AND :END_DATE OR E = :START_DATE",
+        start_date="2024-01-05", end_date=date(2024, 2, 1),
+    )
+    assert sql == "SELECT 1 FROM T WHERE D BETWEEN ? AND ? OR E = ?"
+    assert values == [date(2024, 1, 5), date(2024, 2, 1), date(2024, 1, 5)]
+
+def test_bind_markers_params_and_unknown_names():
+    """Named params bind like dates; names without a value and quoted #-names are left alone"""
+    sql, values = bind_markers(
+        'SELECT "PO#MAN" FROM T WHERE S IN (:PO_STORE_0, :PO_STORE_1) AND X = :OTHER',
+        params={"PO_STORE_0": "110", "PO_STORE_1": "614"},
+    )
+    assert sql == 'SELECT "PO#MAN" FROM T WHERE S IN (?, ?) AND X = :OTHER'
+    assert values == ["110", "614"]
+
+def test_bind_markers_needs_both_dates():
+    """Date markers are only bound when both ends of the range are given"""
+    sql, values = bind_markers("WHERE D >= :START_DATE", start_date="2024-01-05")
+    assert sql == "WHERE D >= :START_DATE"
+    assert values == []
+
+def test_build_record_key():
+    """Keys join the key columns and the date as YYYYMMDD, with NULL for a missing date"""
+    df = pd.DataFrame({
+        'po': ['PO1', 'PO2', 'PO3'],
+        'sku': ['SKU1', 'SKU2', 'SKU3'],
+        'expected_date': [date(2024, 1, 5), None, date(2025, 12, 31)],
+    })
+    keys = build_record_key(df, ('po', 'sku'), 'expected_date')
+    assert keys.tolist() == ['PO1_SKU1_20240105', 'PO2_SKU2_NULL', 'PO3_SKU3_20251231']
+
+def test_build_record_key_column_types():
+    """Categorical, numeric and missing key values and string/timestamp dates all format the same way"""
+    df = pd.DataFrame({
+        'po_man': pd.Categorical(['PM1', 'PM1']),
+        'sku_num': [123, 456],
+        'exp_date': ['2024-03-09', pd.Timestamp('2024-03-10 17:45')],
+    })
+    keys = build_record_key(df, ('po_man', 'sku_num'), 'exp_date')
+    assert keys.tolist() == ['PM1_123_20240309', 'PM1_456_20240310']
+
+    df = pd.DataFrame({'po': ['PO1', None], 'sku': ['S', 'S'], 'd': [date(2024, 1, 5)] * 2})
+    assert build_record_key(df, ('po', 'sku'), 'd').tolist() == ['PO1_S_20240105', 'None_S_20240105']
+
+def test_sqlstate_from_message():
+    """Without a statement handle the SQLSTATE is parsed from the ibm_db message"""
+    error = Exception("[IBM][CLI Driver][AS] SQL0913N  Row or object POHDR in use.  SQLSTATE=57033 SQLCODE=-913")
+    assert _sqlstate(None, error) == "57033"
+    assert _sqlstate(None, Exception("connection reset")) == ""
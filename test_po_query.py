@@ -0,0 +1,24 @@
+"""Unit tests for the PO query module"""
+
+from datetime import date, timedelta
+
+from queries.po_query import get_mock_data
+
+def test_mock_data():
+    """Mock rows carry dates relative to today and matching record keys; each call is a fresh frame"""
+    today = date.today()
+    first = get_mock_data(None, None)
+    assert first['store'].tolist() == ['110', '114', '614']
+    assert first['expected_date'].tolist() == [today + timedelta(days=d) for d in range(3)]
+    assert first['cancel_date'].tolist() == [today + timedelta(days=30)] * 3
+    assert first['latest_datercv'].tolist() == [today - timedelta(days=1)] * 3
+    assert first['shipnotice_date'].tolist() == [today - timedelta(days=2)] * 3
+    assert first['record_key'].tolist() == [
+        f"PO00{i + 1}_SKU00{i + 1}_{(today + timedelta(days=i)).strftime('%Y%m%d')}" for i in range(3)
+    ]
+
+    first.loc[0, 'ooqty'] = -1
+    first.loc[0, 'po'] = 'changed'
+    second = get_mock_data(None, None)
+    assert second.loc[0, 'ooqty'] == 100
+    assert second.loc[0, 'po'] == 'PO001'
@@ -1,14 +1,26 @@
 #!/usr/bin/env python3
 """Test the rolling window and MERGE functionality"""
 
-import requests
+import os
 import json
 from datetime import date, timedelta
 
+# Service exercised when the script is run directly; test runs take MIGRATION_BASE_URL
+DEFAULT_BASE_URL = "https://db2-migration-service-zchpgeskka-uc.a.run.app"
+
 def test_rolling_window():
-    """Test the rolling window migration with mock data"""
-    base_url = "https://db2-migration-service-zchpgeskka-uc.a.run.app"
-    
+    """Test the rolling window migration with mock data (skipped unless MIGRATION_BASE_URL is set)"""
+    base_url = os.environ.get("MIGRATION_BASE_URL")
+    if not base_url:
+        import pytest
+        pytest.skip("MIGRATION_BASE_URL not set; this test calls a deployed service")
+    check_rolling_window(base_url)
+
+def check_rolling_window(base_url):
+    """Run the rolling window checks against a deployed service"""
+    # Imported here so test discovery doesn't load the HTTP client
+    import requests
+
     print("Testing Rolling Window Migration")
     print("=" * 50)
     
@@ -56,7 +68,7 @@ def test_rolling_window():
     
     # Test 4: Health check
     print("\n4. Testing service health...")
-    response = requests.get(f"{base_url}/health")
+    response = requests.get(f"{base_url}/health", params={"verbose": "1"})
     result = response.json()
     print(f"   Health Status: {result['status']}")
     
@@ -72,4 +84,4 @@ def test_rolling_window():
     print(f"  Total window: 90 days of data")
 
 if __name__ == "__main__":
-    test_rolling_window()
\ No newline at end of file
+    check_rolling_window(os.environ.get("MIGRATION_BASE_URL", DEFAULT_BASE_URL))
\ No newline at end of file
@@ -16,7 +16,7 @@ echo ""
 # Test health endpoint
 echo "1. Testing /health endpoint..."
 echo "----------------------------"
-curl -s -H "Authorization: Bearer $TOKEN" "${SERVICE_URL}/health" | python3 -m json.tool
+curl -s -H "Authorization: Bearer $TOKEN" "${SERVICE_URL}/health?verbose=1" | python3 -m json.tool
 echo ""
 
 # Test BigQuery connectivity
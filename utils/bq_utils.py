@@ -1,56 +1,297 @@
+import io
 import os
 import logging
-from datetime import date, timedelta
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import bigquery
+from requests.adapters import HTTPAdapter
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.db_utils import build_record_key, rolling_window, ROLLING_DAYS_BACK, ROLLING_DAYS_FORWARD
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_PROJECT = os.environ.get("PROJECT_ID", "sis-sandbox-463113")
 DEFAULT_DATASET = os.environ.get("BQ_DATASET", "db2_migration")
 RECENT_WINDOW_DAYS = int(os.environ.get("RECENT_WINDOW_DAYS", "14"))
-
-def convert_datatypes_for_bq(df, config):
+# HTTP connections kept open by the shared client; size to the number of concurrent request threads
+BQ_POOL_SIZE = int(os.environ.get("BQ_POOL_SIZE", "16"))
+# Fetched batches allowed to wait for upload when loads are pipelined
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "4"))
+# Append staging rows through the Storage Write API instead of load jobs (falls back to a load job on failure)
+BQ_WRITE_API = os.environ.get("BQ_WRITE_API", "0") == "1"
+# Target size of each AppendRows request (the API rejects requests over 10 MB)
+WRITE_API_CHUNK_BYTES = 4 * 1024 * 1024
+# Batches larger than this (in MiB, in memory) go through a load job even with BQ_WRITE_API=1;
+# load jobs are free while Write API ingestion is billed per byte
+WRITE_API_MAX_BYTES = int(os.environ.get("BQ_WRITE_API_MAX_MB", "64")) * 1024 * 1024
+
+# One BigQuery client per process so PO and Breakout loads share its HTTP connections
+_BQ_CLIENT = None
+_BQ_CLIENT_LOCK = threading.Lock()
+
+def get_bq_client():
+    """Return the process-wide BigQuery client, creating it on first use"""
+    global _BQ_CLIENT
+    if _BQ_CLIENT is None:
+        with _BQ_CLIENT_LOCK:
+            if _BQ_CLIENT is None:
+                _BQ_CLIENT = _build_bq_client()
+    return _BQ_CLIENT
+
+@lru_cache(maxsize=1)
+def _default_credentials():
+    """Resolve Application Default Credentials once; both clients share them and their token"""
+    credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    return credentials
+
+def _build_bq_client():
+    """Build a BigQuery client whose HTTP session pools BQ_POOL_SIZE connections"""
+    credentials = _default_credentials()
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=BQ_POOL_SIZE, pool_maxsize=BQ_POOL_SIZE)
+    session.mount("https://", adapter)
+    logger.info(f"Created BigQuery client with HTTP pool size {BQ_POOL_SIZE}")
+    return bigquery.Client(project=DEFAULT_PROJECT, credentials=credentials, _http=session)
+
+_WRITE_CLIENT = None
+
+def get_write_client():
+    """Return the process-wide Storage Write API client, creating it on first use"""
+    global _WRITE_CLIENT
+    if _WRITE_CLIENT is None:
+        with _BQ_CLIENT_LOCK:
+            if _WRITE_CLIENT is None:
+                from google.cloud import bigquery_storage_v1
+                _WRITE_CLIENT = bigquery_storage_v1.BigQueryWriteClient(credentials=_default_credentials())
+    return _WRITE_CLIENT
+
+_DATE32 = pd.ArrowDtype(pa.date32())
+_STRING = pd.StringDtype("pyarrow")
+
+def convert_datatypes_for_bq(df, config, load_timestamp=None):
     """Convert DataFrame data types for BigQuery compatibility"""
     logger.info("Converting data types for BigQuery compatibility")
 
-    # Integer columns
-    for col in config.get('integer_columns', []):
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('Int64')
-
-    # Date columns
+    # Integer columns, as nullable Int64 so missing values load as NULL rather than 0 (configs
+    # that want zeros set int_fillna_zero). Fractions are truncated, as INTEGER can't hold them.
+    # Columns the fetch already produced as numpy integers keep their width (int32 loads as-is)
+    int_cols = [col for col in config.get('integer_columns', [])
+                if col in df.columns and not (isinstance(df[col].dtype, np.dtype) and df[col].dtype.kind in 'iu')]
+    fill_zero = config.get('int_fillna_zero', False)
+    # Sparse DB2 columns that came back entirely NULL get a typed column directly, skipping the parse
+    for col in [col for col in int_cols if _all_null(df[col])]:
+        zeros = np.zeros(len(df), dtype='int64')
+        df[col] = zeros if fill_zero else pd.arrays.IntegerArray(zeros, np.ones(len(df), dtype=bool))
+        int_cols.remove(col)
+    if int_cols:
+        values = np.trunc(df[int_cols].apply(pd.to_numeric, errors='coerce'))
+        if fill_zero:
+            df[int_cols] = values.fillna(0).astype('int64')
+        else:
+            df[int_cols] = values.astype('Int64')
+
+    # Date columns, as Arrow date32 (no per-row datetime.date objects; the upload reuses the buffer)
     for col in config.get('date_columns', []):
-        if col in df.columns and df[col].notna().any():
-            df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
+        if col in df.columns:
+            if _all_null(df[col]):
+                df[col] = pd.arrays.ArrowExtensionArray(pa.nulls(len(df), pa.date32()))
+            else:
+                df[col] = pd.to_datetime(df[col], errors='coerce').dt.normalize().astype(_DATE32)
 
-    # String columns
+    # String columns (Arrow-backed so the BigQuery load serializes them without reboxing;
+    # categoricals stay dictionary-encoded)
     for col in config.get('string_columns', []):
         if col in df.columns:
-            df[col] = df[col].astype(str).replace('None', '')
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = _fill_categorical(df[col])
+            elif _all_null(df[col]):
+                df[col] = pd.arrays.ArrowStringArray(pa.repeat('', len(df)))
+            else:
+                df[col] = _fill_string(df[col])
 
     # Add timestamp for this batch
-    df['load_timestamp'] = pd.Timestamp.now(tz="UTC")
+    df['load_timestamp'] = load_timestamp if load_timestamp is not None else pd.Timestamp.now(tz="UTC")
 
     return df
 
-def cleanup_old_records(client, table_ref, days_back=30, days_forward=60, date_column='expected_date'):
+def _all_null(values):
+    """True if a column holds no values; populated columns are usually settled by their first row"""
+    return len(values) == 0 or (pd.isna(values.iat[0]) and values.isna().all())
+
+def _fill_string(values):
+    """Return a column as string[pyarrow] with '' for nulls (no cast when it already is one)"""
+    if values.dtype != _STRING:
+        values = values.astype(_STRING)
+    return values.fillna('')
+
+def _fill_categorical(values):
+    """Give a categorical column string categories and '' in place of nulls"""
+    if not pd.api.types.is_string_dtype(values.cat.categories):
+        values = values.astype(str).astype('category')
+    if '' not in values.cat.categories:
+        values = values.cat.add_categories('')
+    return values.fillna('')
+
+def build_load_schema(df, config):
+    """Build an explicit load schema from the config column types so BigQuery skips inference"""
+    field_types = {'record_key': 'STRING', 'load_timestamp': 'TIMESTAMP'}
+    field_types.update({col: 'STRING' for col in config.get('string_columns', [])})
+    field_types.update({col: 'DATE' for col in config.get('date_columns', [])})
+    field_types.update({col: 'INTEGER' for col in config.get('integer_columns', [])})
+    # Columns the config doesn't type are left to the client's inference
+    return [bigquery.SchemaField(col, field_types[col]) for col in df.columns if col in field_types]
+
+# Arrow type for each BigQuery load type, for columns whose Arrow type pandas can't infer
+_ARROW_TYPES = {
+    'STRING': pa.string(),
+    'DATE': pa.date32(),
+    'INTEGER': pa.int64(),
+    'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+}
+
+def dataframe_to_parquet_buffer(df, schema=None):
+    """Serialize a DataFrame to an in-memory, snappy-compressed Parquet file ready for upload
+
+    With a load schema, columns that came out untyped (all-null object columns) are given the
+    schema's type, so the file matches the table; typed columns keep their encoding as-is.
+    """
+    # The pandas metadata is only needed to rebuild the frame, which BigQuery never does
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    if schema:
+        for field in schema:
+            index = table.schema.get_field_index(field.name)
+            if index >= 0 and pa.types.is_null(table.schema.field(index).type) and field.field_type in _ARROW_TYPES:
+                target = _ARROW_TYPES[field.field_type]
+                table = table.set_column(index, pa.field(field.name, target), table.column(index).cast(target))
+    buf = io.BytesIO()
+    # BigQuery reads Parquet timestamps at microsecond precision
+    pq.write_table(table, buf, compression='snappy', coerce_timestamps='us', allow_truncated_timestamps=True)
+    buf.seek(0)
+    return buf
+
+def _is_partitioned_on(client, table_ref, column):
+    """True if the table is day-partitioned on the given column"""
+    partitioning = client.get_table(table_ref).time_partitioning
+    return partitioning is not None and partitioning.field == column
+
+def drop_old_partitions(client, table_ref, cutoff_date_past, cutoff_date_future):
+    """Delete whole day partitions outside the window (no DML, so no DML quota or scan cost)"""
+    project, dataset, table = table_ref.split('.')
+    partitions_query = f"""
+    SELECT partition_id, total_rows
+    FROM `{project}.{dataset}.INFORMATION_SCHEMA.PARTITIONS`
+    WHERE table_name = @table_name
+      AND partition_id NOT IN ('__NULL__', '__UNPARTITIONED__')
+      AND (partition_id < @past_id OR partition_id > @future_id)
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('table_name', 'STRING', table),
+        bigquery.ScalarQueryParameter('past_id', 'STRING', cutoff_date_past.strftime('%Y%m%d')),
+        bigquery.ScalarQueryParameter('future_id', 'STRING', cutoff_date_future.strftime('%Y%m%d')),
+    ])
+
+    deleted_rows = 0
+    for row in client.query(partitions_query, job_config=job_config).result():
+        client.delete_table(f"{table_ref}${row.partition_id}", not_found_ok=True)
+        deleted_rows += row.total_rows or 0
+    return deleted_rows
+
+def append_via_write_api(df, staging_ref):
+    """Append a DataFrame to a table as Arrow record batches (no load job)
+
+    Rows go to a PENDING stream that is committed once every request succeeded, so the
+    append is all-or-nothing and a failed one can be retried as a load job without duplicates.
+    """
+    from google.cloud.bigquery_storage_v1 import types as write_types
+
+    project, dataset, table_name = staging_ref.split('.')
+    parent = f"projects/{project}/datasets/{dataset}/tables/{table_name}"
+
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    # The Write API takes timestamps at microsecond precision, INTEGER columns as int64 and
+    # categoricals as plain strings
+    table = table.cast(pa.schema([
+        pa.field(f.name, pa.timestamp('us', tz=f.type.tz)) if pa.types.is_timestamp(f.type)
+        else pa.field(f.name, pa.int64()) if pa.types.is_integer(f.type)
+        else pa.field(f.name, f.type.value_type) if pa.types.is_dictionary(f.type)
+        else f
+        for f in table.schema
+    ]))
+    rows_per_request = max(1, WRITE_API_CHUNK_BYTES * max(table.num_rows, 1) // max(table.nbytes, 1))
+
+    requests = []
+    for batch in table.to_batches(max_chunksize=rows_per_request):
+        requests.append(write_types.AppendRowsRequest(
+            arrow_rows=write_types.AppendRowsRequest.ArrowData(
+                rows=write_types.ArrowRecordBatch(serialized_record_batch=batch.serialize().to_pybytes())
+            )
+        ))
+    if not requests:
+        return 0
+
+    write_client = get_write_client()
+    stream = write_client.create_write_stream(
+        parent=parent, write_stream=write_types.WriteStream(type_=write_types.WriteStream.Type.PENDING)
+    ).name
+    # The first request on the connection names the stream and carries the schema
+    requests[0].write_stream = stream
+    requests[0].arrow_rows.writer_schema = write_types.ArrowSchema(
+        serialized_schema=table.schema.serialize().to_pybytes()
+    )
+
+    responses = write_client.append_rows(
+        iter(requests), metadata=(("x-goog-request-params", f"write_stream={stream}"),)
+    )
+    for response in responses:
+        if response.error.code:
+            raise RuntimeError(f"AppendRows failed: {response.error.message}")
+        if response.row_errors:
+            raise RuntimeError(f"AppendRows rejected {len(response.row_errors)} rows: {response.row_errors[0].message}")
+
+    write_client.finalize_write_stream(name=stream)
+    commit = write_client.batch_commit_write_streams(parent=parent, write_streams=[stream])
+    if commit.stream_errors:
+        raise RuntimeError(f"Write stream commit failed: {commit.stream_errors[0].error_message}")
+
+    logger.info(f"Appended {table.num_rows} rows to {staging_ref} in {len(requests)} Write API requests")
+    return table.num_rows
+
+def cleanup_old_records(client, table_ref, days_back=ROLLING_DAYS_BACK, days_forward=ROLLING_DAYS_FORWARD,
+                        date_column='expected_date'):
     """Remove records outside the rolling window"""
-    today = date.today()
-    cutoff_date_past = today - timedelta(days=days_back)
-    cutoff_date_future = today + timedelta(days=days_forward)
+    cutoff_date_past, cutoff_date_future = rolling_window(days_back=days_back, days_forward=days_forward)
+
+    try:
+        if _is_partitioned_on(client, table_ref, date_column):
+            logger.info(f"Dropping partitions of {table_ref} outside rolling window: < {cutoff_date_past} or > {cutoff_date_future}")
+            deleted_rows = drop_old_partitions(client, table_ref, cutoff_date_past, cutoff_date_future)
+            logger.info(f"Cleanup completed. Dropped partitions holding {deleted_rows} records outside the rolling window")
+            return deleted_rows
+    except Exception as e:
+        logger.warning(f"Partition cleanup failed, falling back to DELETE: {str(e)}")
 
+    # Dates are bound as parameters so the SQL text stays identical from day to day
     cleanup_query = f"""
     DELETE FROM `{table_ref}`
-    WHERE {date_column} < DATE('{cutoff_date_past}')
-       OR {date_column} > DATE('{cutoff_date_future}')
+    WHERE {date_column} < @past
+       OR {date_column} > @future
     """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('past', 'DATE', cutoff_date_past),
+        bigquery.ScalarQueryParameter('future', 'DATE', cutoff_date_future),
+    ])
 
     logger.info(f"Cleaning up records outside rolling window: < {cutoff_date_past} or > {cutoff_date_future}")
 
     try:
-        cleanup_job = client.query(cleanup_query)
+        cleanup_job = client.query(cleanup_query, job_config=job_config)
         cleanup_job.result()
 
         deleted_rows = cleanup_job.num_dml_affected_rows
@@ -62,166 +303,285 @@ def cleanup_old_records(client, table_ref, days_back=30, days_forward=60, date_c
         return 0
 
 
-def cleanup_stale_records(client, final_ref, staging_ref):
+def load_to_bigquery(df, config, use_merge=True):
     """
-    Remove records from final table that weren't refreshed in the latest batch.
+    Load data to BigQuery with staging and final table strategy
 
-    This eliminates ghost data - records that no longer exist in the source DB2
-    but remain in BigQuery because they're still within the date window.
-    """
-    cleanup_query = f"""
-    DELETE FROM `{final_ref}` F
-    WHERE F.load_timestamp < (
-        SELECT MAX(load_timestamp) FROM `{staging_ref}`
-    )
+    Args:
+        df: DataFrame to load
+        config: Configuration dictionary with table names and column mappings
+        use_merge: Whether to use MERGE strategy for final table
     """
+    # Nothing new to merge, and stale cleanup against an unchanged staging table would be wasted DML
+    if df.empty:
+        logger.info("Empty DataFrame - skipping staging load, MERGE and cleanup")
+        return 0
 
-    logger.info(f"Cleaning up stale records not refreshed in latest batch from {final_ref}")
+    client = get_bq_client()
 
-    try:
-        cleanup_job = client.query(cleanup_query)
-        cleanup_job.result()
+    staging_ref = f"{client.project}.{DEFAULT_DATASET}.{config['staging_table']}"
+    final_ref = f"{client.project}.{DEFAULT_DATASET}.{config['final_table']}"
 
-        deleted_rows = cleanup_job.num_dml_affected_rows
-        logger.info(f"Stale cleanup completed. Deleted {deleted_rows} records not in latest refresh.")
+    # 1) Append to STAGING
+    rows_loaded = append_to_staging(client, df, config, staging_ref)
 
-        return deleted_rows
-    except Exception as e:
-        logger.warning(f"Stale cleanup failed (non-critical): {str(e)}")
-        return 0
+    if not use_merge:
+        logger.info("use_merge=False → Skipping MERGE to final; staging append only")
+        return rows_loaded
 
-def load_to_bigquery(df, config, use_merge=True):
+    finalize_load(client, config, staging_ref, final_ref)
+    return rows_loaded
+
+def load_batches_to_bigquery(batches, config, use_merge=True):
     """
-    Load data to BigQuery with staging and final table strategy
+    Load DataFrame batches to BigQuery, uploading each batch while the next is being fetched
+
+    Batches are handed to a loader thread through a bounded queue, so DB2 fetch waits
+    overlap BigQuery upload waits. The MERGE and cleanups run once after the last batch.
 
     Args:
-        df: DataFrame to load
+        batches: Iterable of DataFrames (e.g. a DB2 batch generator)
         config: Configuration dictionary with table names and column mappings
         use_merge: Whether to use MERGE strategy for final table
+
+    Returns:
+        Total rows loaded (0 if no batch had rows, in which case nothing is merged)
     """
-    client = bigquery.Client(project=DEFAULT_PROJECT)
+    client = get_bq_client()
 
     staging_ref = f"{client.project}.{DEFAULT_DATASET}.{config['staging_table']}"
     final_ref = f"{client.project}.{DEFAULT_DATASET}.{config['final_table']}"
 
-    # Convert data types
-    df = convert_datatypes_for_bq(df, config)
-
-    # Ensure record_key exists
-    if 'record_key' not in df.columns and 'generate_record_key' in config:
-        logger.info("Generating record_key for deduplication")
-        df['record_key'] = df.apply(config['generate_record_key'], axis=1)
-
-    # 1) Append to STAGING
-    logger.info(f"Appending {len(df)} rows to staging: {staging_ref}")
-    load_cfg = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
-    job = client.load_table_from_dataframe(df, staging_ref, job_config=load_cfg)
-    job.result()
+    # One timestamp for every batch so stale cleanup treats the whole run as the latest refresh
+    load_timestamp = pd.Timestamp.now(tz="UTC")
+    pending = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    state = {'rows': 0, 'error': None}
+
+    def loader():
+        while True:
+            df = pending.get()
+            if df is None:
+                return
+            if state['error'] is not None:
+                continue  # keep draining so the producer never blocks on a full queue
+            try:
+                state['rows'] += append_to_staging(client, df, config, staging_ref, load_timestamp)
+            except Exception as e:
+                state['error'] = e
+
+    worker = threading.Thread(target=loader, name="bq-loader", daemon=True)
+    worker.start()
+    try:
+        for df in batches:
+            if state['error'] is not None:
+                break
+            if not df.empty:
+                pending.put(df)
+    finally:
+        pending.put(None)
+        worker.join()
+
+    if state['error'] is not None:
+        raise state['error']
+    if state['rows'] == 0:
+        return 0
 
     if not use_merge:
         logger.info("use_merge=False → Skipping MERGE to final; staging append only")
-        return len(df)
+        return state['rows']
 
-    # 2) MERGE into FINAL using latest per record_key
-    merge_to_final(client, staging_ref, final_ref, config)
+    finalize_load(client, config, staging_ref, final_ref)
+    return state['rows']
 
-    # 3) Housekeeping: cleanup old records from staging
-    if config.get('cleanup_staging', True):
+def append_to_staging(client, df, config, staging_ref, load_timestamp=None):
+    """Normalize types, add record keys and append one DataFrame to the staging table"""
+    # Convert data types
+    df = convert_datatypes_for_bq(df, config, load_timestamp)
+
+    # Ensure record_key exists: '<key>_<key>_<YYYYMMDD>' from the configured key columns and date_column
+    if 'record_key' not in df.columns and config.get('record_key_columns'):
+        logger.info("Generating record_key for deduplication")
+        df['record_key'] = build_record_key(df, config['record_key_columns'],
+                                            config.get('date_column', 'expected_date'))
+
+    logger.info(f"Appending {len(df)} rows to staging: {staging_ref}")
+    if BQ_WRITE_API and df.memory_usage(index=False).sum() <= WRITE_API_MAX_BYTES:
         try:
-            deleted = cleanup_old_records(
-                client, staging_ref,
-                date_column=config.get('date_column', 'expected_date')
-            )
-            logger.info(f"Staging cleanup deleted {deleted} old rows.")
+            return append_via_write_api(df, staging_ref)
         except Exception as e:
-            logger.warning(f"Staging cleanup skipped/failed: {e}")
+            # The stream is only committed after every append succeeded, so nothing was written yet
+            logger.warning(f"Storage Write API append failed, falling back to a load job: {e}")
 
-    # 4) Cleanup old records from final table (remove phantom/ghost data outside date window)
-    if config.get('cleanup_final', True):
-        try:
-            deleted_final = cleanup_old_records(
-                client, final_ref,
-                days_back=config.get('days_back', 30),
-                days_forward=config.get('days_forward', 60),
+    load_cfg = bigquery.LoadJobConfig(
+        schema=build_load_schema(df, config),
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+    )
+    buf = dataframe_to_parquet_buffer(df, load_cfg.schema)
+    logger.info(f"Uploading {buf.getbuffer().nbytes} bytes of Parquet to staging")
+    job = client.load_table_from_file(buf, staging_ref, job_config=load_cfg)
+    job.result()
+    return len(df)
+
+def finalize_load(client, config, staging_ref, final_ref):
+    """MERGE staging into final, then run the configured cleanups"""
+    # Staging cleanup only touches staging rows outside the window, which the MERGE never keeps
+    # (final cleanup drops them again), so it runs alongside the MERGE; the final-table cleanups
+    # are DML on the same table and run inside the MERGE script, after its transaction
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        staging_cleanup = None
+        if config.get('cleanup_staging', True):
+            staging_cleanup = executor.submit(
+                cleanup_old_records, client, staging_ref,
                 date_column=config.get('date_column', 'expected_date')
             )
-            logger.info(f"Final table cleanup deleted {deleted_final} old rows outside rolling window.")
-        except Exception as e:
-            logger.warning(f"Final table cleanup skipped/failed: {e}")
 
-    # 5) Cleanup stale records not refreshed in latest batch (removes ghost data within date window)
-    if config.get('cleanup_stale', True):
-        try:
-            deleted_stale = cleanup_stale_records(client, final_ref, staging_ref)
-            logger.info(f"Stale record cleanup deleted {deleted_stale} rows not in latest refresh.")
-        except Exception as e:
-            logger.warning(f"Stale record cleanup skipped/failed: {e}")
+        # 2) MERGE into FINAL using latest per record_key (3-4: final-table cleanups in the same job)
+        merge_to_final(client, staging_ref, final_ref, config)
 
-    return len(df)
+        # 5) Housekeeping: old records removed from staging
+        if staging_cleanup is not None:
+            try:
+                logger.info(f"Staging cleanup deleted {staging_cleanup.result()} old rows.")
+            except Exception as e:
+                logger.warning(f"Staging cleanup skipped/failed: {e}")
 
 def merge_to_final(client, staging_ref, final_ref, config):
-    """Execute MERGE from staging to final table"""
+    """Upsert the latest staging row per record_key into final (partition-scoped DELETE + INSERT)"""
     logger.info(f"Merging latest per record_key from last {RECENT_WINDOW_DAYS} days into final: {final_ref}")
 
-    # Get column list for MERGE statement
     columns = config.get('columns', [])
-
-    # Build UPDATE SET clause
-    update_clause = ',\n      '.join([f"{col} = S.{col}" for col in columns if col != 'record_key'])
-
-    # Build INSERT columns
     insert_columns = ', '.join(columns)
+    date_column = config.get('date_column', 'expected_date')
+    # BigQuery bills for every column a query references, so staging is read only for the
+    # configured columns (they include record_key, load_timestamp and the merge ordering)
+    staging_columns = insert_columns or '*'
 
+    # Replacing matched keys with DELETE + INSERT costs less than a MERGE over the whole final
+    # table; record_key embeds the date, so the DELETE only needs the partitions the batch covers
     merge_sql = f"""
-    -- Ensure FINAL exists (schema will be inferred from staging on first successful MERGE)
-    CREATE TABLE IF NOT EXISTS `{final_ref}` AS
-    SELECT * FROM `{staging_ref}` WHERE 1=0;
-
-    MERGE `{final_ref}` T
-    USING (
-      WITH recent AS (
-        SELECT *
-        FROM `{staging_ref}`
-        WHERE DATE(load_timestamp) >= DATE_SUB(CURRENT_DATE(), INTERVAL {RECENT_WINDOW_DAYS} DAY)
-      ),
-      ranked AS (
-        SELECT
-         r.*,
-         ROW_NUMBER() OVER (
-            PARTITION BY record_key
-            ORDER BY {config.get('merge_order_by', 'load_timestamp DESC')}
-         ) AS rn
-        FROM recent r
-     )
-    SELECT * EXCEPT(rn)
-     FROM ranked
-     WHERE rn = 1
-    ) S
-    ON T.record_key = S.record_key
-    WHEN MATCHED THEN UPDATE SET
-      {update_clause}
-    WHEN NOT MATCHED THEN
-      INSERT ROW;
+    DECLARE lo, hi DATE;
+    DECLARE has_null_date BOOL;
+
+    -- Ensure FINAL exists, partitioned on the window date and clustered on the merge key
+    CREATE TABLE IF NOT EXISTS `{final_ref}`
+    PARTITION BY {date_column}
+    CLUSTER BY record_key AS
+    SELECT {staging_columns} FROM `{staging_ref}` WHERE 1=0;
+
+    CREATE TEMP TABLE latest AS
+    SELECT {staging_columns}
+    FROM `{staging_ref}`
+    WHERE DATE(load_timestamp) >= DATE_SUB(CURRENT_DATE(), INTERVAL @recent_days DAY)
+    QUALIFY ROW_NUMBER() OVER (
+      PARTITION BY record_key
+      ORDER BY {config.get('merge_order_by', 'load_timestamp DESC')}
+    ) = 1;
+
+    -- Target-side partition bounds: the batch's date range, plus the NULL partition only when needed
+    SET (lo, hi, has_null_date) = (
+      SELECT AS STRUCT MIN({date_column}), MAX({date_column}), COUNTIF({date_column} IS NULL) > 0
+      FROM latest
+    );
+
+    -- An empty FINAL (first load) has nothing to replace: a plain INSERT, no DELETE or transaction.
+    -- COUNT(*) without a filter is answered from table metadata, so the check scans nothing
+    IF (SELECT COUNT(*) FROM `{final_ref}`) = 0 THEN
+      INSERT INTO `{final_ref}` ({insert_columns})
+      SELECT {insert_columns} FROM latest;
+    ELSE
+      BEGIN TRANSACTION;
+
+      DELETE FROM `{final_ref}` T
+      WHERE (T.{date_column} BETWEEN lo AND hi OR (has_null_date AND T.{date_column} IS NULL))
+        AND T.record_key IN (SELECT record_key FROM latest);
+
+      INSERT INTO `{final_ref}` ({insert_columns})
+      SELECT {insert_columns} FROM latest;
+
+      COMMIT TRANSACTION;
+    END IF;
     """
 
-    merge_job = client.query(merge_sql)
+    # Final-table cleanups run in the same job rather than as separate queries. Each sits in its
+    # own exception block, so a failed cleanup doesn't fail the committed merge; its error comes
+    # back as a cleanup_error row that _log_cleanup_results reports
+    cleanups = {}
+    if config.get('cleanup_final', True):
+        # Rows outside the rolling window; a filter on whole partitions is a metadata-only delete
+        cleanups['rolling window'] = f"DELETE FROM `{final_ref}` WHERE {date_column} < @past OR {date_column} > @future;"
+    if config.get('cleanup_stale', True):
+        # Ghost rows: keys no longer in DB2 that weren't refreshed by the latest batch
+        cleanups['stale record'] = f"""DELETE FROM `{final_ref}`
+      WHERE load_timestamp < (SELECT MAX(load_timestamp) FROM `{staging_ref}`);"""
+    for name, cleanup in cleanups.items():
+        merge_sql += f"""
+    BEGIN
+      {cleanup}
+    EXCEPTION WHEN ERROR THEN
+      SELECT '{name}' AS cleanup, @@error.message AS cleanup_error;
+    END;
+    """
+
+    cutoff_date_past, cutoff_date_future = rolling_window(
+        days_back=config.get('days_back', ROLLING_DAYS_BACK),
+        days_forward=config.get('days_forward', ROLLING_DAYS_FORWARD),
+    )
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('recent_days', 'INT64', RECENT_WINDOW_DAYS),
+        bigquery.ScalarQueryParameter('past', 'DATE', cutoff_date_past),
+        bigquery.ScalarQueryParameter('future', 'DATE', cutoff_date_future),
+    ])
+    merge_job = client.query(merge_sql, job_config=job_config)
     merge_job.result()
-    logger.info(f"MERGE complete (affected rows reported by DML counters may be null for MERGE).")
+    logger.info("Merge into final complete")
+    if cleanups:
+        _log_cleanup_results(client, merge_job, cleanups, final_ref)
+
+def _normalize_sql(sql):
+    """Collapse whitespace and the trailing semicolon so statement texts compare equal"""
+    return ' '.join(sql.strip().rstrip(';').split())
+
+def _log_cleanup_results(client, merge_job, cleanups, final_ref):
+    """Log the rows each cleanup in a merge script deleted, and any cleanup that failed
 
-def create_table_if_not_exists(client, table_id, schema):
-    """Create a BigQuery table if it doesn't exist"""
+    Every statement of a script runs as a child job of the script job; cleanups are matched
+    to their child job by statement text.
+    """
+    statements = {_normalize_sql(sql): name for name, sql in cleanups.items()}
+    try:
+        for job in client.list_jobs(parent_job=merge_job.job_id):
+            text = _normalize_sql(getattr(job, 'query', None) or '')
+            if text in statements:
+                logger.info(f"Final table {statements[text]} cleanup deleted {job.num_dml_affected_rows} rows from {final_ref}")
+            elif 'cleanup_error' in text:
+                for row in job.result():
+                    logger.warning(f"Final table {row.cleanup} cleanup failed (non-critical): {row.cleanup_error}")
+    except Exception as e:
+        logger.warning(f"Could not read cleanup results of merge job {merge_job.job_id}: {e}")
+
+def create_table_if_not_exists(client, table_id, schema, partition_field=None, cluster_fields=None):
+    """Create a BigQuery table if it doesn't exist, optionally day-partitioned on a DATE column
+    and clustered on cluster_fields"""
     try:
         client.get_table(table_id)
         logger.info(f"Table {table_id} already exists")
     except Exception:
         table = bigquery.Table(table_id, schema=schema)
+        if partition_field:
+            table.time_partitioning = bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY, field=partition_field
+            )
+        if cluster_fields:
+            table.clustering_fields = list(cluster_fields)
         table = client.create_table(table)
         logger.info(f"Created table {table_id}")
 
+@lru_cache(maxsize=8)
 def get_table_schema(table_type):
-    """Get BigQuery table schema based on table type"""
+    """Get BigQuery table schema based on table type (built once and shared, hence a tuple)"""
     if table_type == "po":
-        return [
+        return (
             bigquery.SchemaField("store", "STRING"),
             bigquery.SchemaField("vendor", "STRING"),
             bigquery.SchemaField("ss", "STRING"),
@@ -245,9 +605,9 @@ def get_table_schema(table_type):
             bigquery.SchemaField("shipnotice_date", "DATE"),
             bigquery.SchemaField("record_key", "STRING"),
             bigquery.SchemaField("load_timestamp", "TIMESTAMP"),
-        ]
+        )
     elif table_type == "breakout":
-        return [
+        return (
             bigquery.SchemaField("parent_po_man", "STRING"),
             bigquery.SchemaField("ss", "STRING"),
             bigquery.SchemaField("vendor", "STRING"),
@@ -260,6 +620,6 @@ def get_table_schema(table_type):
             bigquery.SchemaField("breakout_qty", "INT64"),
             bigquery.SchemaField("record_key", "STRING"),
             bigquery.SchemaField("load_timestamp", "TIMESTAMP"),
-        ]
+        )
     else:
         raise ValueError(f"Unknown table type: {table_type}")
\ No newline at end of file
@@ -1,38 +1,157 @@
+import atexit
+import queue
 import socket
+import select
+import errno
+import hashlib
 import json
 import os
+import re
 import logging
 import time
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from google.cloud import secretmanager
 import pandas as pd
 import numpy as np
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# In-process cache for the DB2 secret so hot paths don't round-trip to Secret Manager
+SECRET_CACHE_TTL = int(os.environ.get("SECRET_CACHE_TTL", "300"))
+# Location of a regional secret (e.g. us-central1); empty for a global secret
+SECRET_MANAGER_LOCATION = os.environ.get("SECRET_MANAGER_LOCATION", "")
+_SECRET_CACHE = {"value": None, "expires": 0.0}
+_SECRET_LOCK = threading.Lock()
+
 def get_secret_payload():
+    """Return DB2 connection configuration, cached for SECRET_CACHE_TTL seconds"""
+    with _SECRET_LOCK:
+        if _SECRET_CACHE["value"] is not None and time.monotonic() < _SECRET_CACHE["expires"]:
+            return _SECRET_CACHE["value"]
+
+        config = _fetch_secret_payload()
+        _SECRET_CACHE["value"] = config
+        _SECRET_CACHE["expires"] = time.monotonic() + SECRET_CACHE_TTL
+        return config
+
+def invalidate_secret_cache():
+    """Drop the cached DB2 secret so the next call re-reads Secret Manager"""
+    with _SECRET_LOCK:
+        _SECRET_CACHE["value"] = None
+        _SECRET_CACHE["expires"] = 0.0
+    logger.info("DB2 secret cache invalidated")
+
+def _is_auth_error(message):
+    """Check whether a DB2 error message indicates rejected credentials"""
+    message = message.lower()
+    return "sql30082n" in message or "password" in message or "authentication" in message
+
+# DB2 fetch engine: 'ibm_db' (row-at-a-time CLI) or 'arrow_odbc' (columnar batches, needs unixODBC + the DB2 ODBC driver)
+DB2_FETCH_ENGINE = os.environ.get("DB2_FETCH_ENGINE", "ibm_db")
+DB2_ODBC_DRIVER = os.environ.get("DB2_ODBC_DRIVER", "IBM DB2 ODBC DRIVER")
+ARROW_BATCH_SIZE = int(os.environ.get("ARROW_BATCH_SIZE", "20000"))
+# Let arrow-odbc fill the next batch on its own thread while Python decodes the current one
+FETCH_CONCURRENT = os.environ.get("FETCH_CONCURRENT", "0") == "1"
+# Rows converted to a DataFrame at a time by the ibm_db engine (bounds the row tuples held in memory)
+FETCH_BATCH_ROWS = int(os.environ.get("FETCH_BATCH_ROWS", "10000"))
+# Rows DB2 CLI returns per network block for read-only cursors (BlockForNRows; 0 = driver default)
+DB2_BLOCK_ROWS = int(os.environ.get("DB2_BLOCK_ROWS", "0"))
+
+# Resolved DB2 host addresses are reused for this many seconds before re-resolving
+DNS_CACHE_TTL = int(os.environ.get("DNS_CACHE_TTL", "300"))
+
+@lru_cache(maxsize=32)
+def _resolve(host, port, ttl_bucket):
+    """Resolve host/port to stream socket addresses (ttl_bucket expires the cache entry)"""
+    return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+
+def check_tcp(host, port, timeout=3.0):
+    """Connect to host:port and return the connect latency in ms, raising OSError if unreachable"""
+    addresses = _resolve(host, int(port), int(time.monotonic() // DNS_CACHE_TTL))
+    last_error = None
+    for family, socktype, proto, canonname, sockaddr in addresses:
+        try:
+            return _timed_connect(family, socktype, proto, sockaddr, timeout)
+        except OSError as e:
+            last_error = e
+    raise last_error or OSError(f"No addresses found for {host}:{port}")
+
+def _timed_connect(family, socktype, proto, sockaddr, timeout):
+    """Non-blocking connect to one address, waiting on select() for at most timeout seconds"""
+    s = socket.socket(family, socktype, proto)
+    try:
+        s.setblocking(False)
+        start = time.monotonic()
+        err = s.connect_ex(sockaddr)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise OSError(err, os.strerror(err))
+        if err != 0:
+            _, writable, _ = select.select([], [s], [], timeout)
+            if not writable:
+                raise TimeoutError(f"Connection to {sockaddr[0]}:{sockaddr[1]} timed out after {timeout}s")
+            err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise OSError(err, os.strerror(err))
+        return (time.monotonic() - start) * 1000
+    finally:
+        s.close()
+
+@lru_cache(maxsize=1)
+def _sm_client():
+    """Return the process-wide Secret Manager client (its gRPC channel is reused across fetches)"""
+    if SECRET_MANAGER_LOCATION:
+        # Regional secrets are only served by their regional endpoint
+        return secretmanager.SecretManagerServiceClient(
+            client_options={"api_endpoint": f"secretmanager.{SECRET_MANAGER_LOCATION}.rep.googleapis.com"}
+        )
+    return secretmanager.SecretManagerServiceClient()
+
+def _fetch_secret_payload():
     """Retrieve DB2 connection configuration from Google Secret Manager"""
     logger.info("Retrieving DB2 connection secret from Secret Manager")
-    sm = secretmanager.SecretManagerServiceClient()
+    sm = _sm_client()
     project_id = os.environ.get("PROJECT_ID", "sis-sandbox-463113")
     secret_name = os.environ.get("DB2_SECRET_NAME", "IBM_connect")
-    name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-    logger.debug(f"Fetching secret: {name}")
+    if SECRET_MANAGER_LOCATION:
+        name = f"projects/{project_id}/locations/{SECRET_MANAGER_LOCATION}/secrets/{secret_name}/versions/latest"
+    else:
+        name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Fetching secret: {name}")
 
     try:
         resp = sm.access_secret_version(name=name)
         config = json.loads(resp.payload.data.decode("utf-8"))
         logger.info(f"Secret retrieved successfully. Config keys: {list(config.keys())}")
-        logger.debug(f"DB2 Host: {config.get('host', 'NOT SET')}")
-        logger.debug(f"DB2 Port: {config.get('port', 446)}")
-        logger.debug(f"DB2 Database: {config.get('database', 'MYDB')}")
-        logger.debug(f"DB2 User: {config.get('user', 'NOT SET')}")
-        logger.debug(f"SSL Enabled: {config.get('security') == 'SSL'}")
+        # f-strings format eagerly, so skip building the debug lines unless they'll be emitted
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"DB2 Host: {config.get('host', 'NOT SET')}")
+            logger.debug(f"DB2 Port: {config.get('port', 446)}")
+            logger.debug(f"DB2 Database: {config.get('database', 'MYDB')}")
+            logger.debug(f"DB2 User: {config.get('user', 'NOT SET')}")
+            logger.debug(f"SSL Enabled: {config.get('security') == 'SSL'}")
         return config
     except Exception as e:
         logger.error(f"Failed to retrieve secret: {str(e)}")
         raise
 
+def build_connection_string(config):
+    """Build the DB2 CLI connection string from the secret configuration"""
+    conn_str = f"DATABASE={config.get('database', 'MYDB')};"
+    conn_str += f"HOSTNAME={config['host']};"
+    conn_str += f"PORT={config.get('port', 446)};"
+    conn_str += f"PROTOCOL=TCPIP;"
+    conn_str += f"UID={config['user']};"
+    conn_str += f"PWD={config['password']};"
+    if config.get('security') == 'SSL':
+        conn_str += "SECURITY=SSL;"
+    if DB2_BLOCK_ROWS:
+        conn_str += f"BlockForNRows={DB2_BLOCK_ROWS};"
+    return conn_str
+
 def connect_to_db2(config=None):
     """Establish connection to DB2 database"""
     import ibm_db
@@ -49,32 +168,14 @@ def connect_to_db2(config=None):
             logger.warning(f"Could not enable DB2 debug mode: {e}")
 
     # Build connection string
-    conn_str = f"DATABASE={config.get('database', 'MYDB')};"
-    conn_str += f"HOSTNAME={config['host']};"
-    conn_str += f"PORT={config.get('port', 446)};"
-    conn_str += f"PROTOCOL=TCPIP;"
-    conn_str += f"UID={config['user']};"
-    conn_str += f"PWD={config['password']};"
+    conn_str = build_connection_string(config)
     if config.get('security') == 'SSL':
-        conn_str += "SECURITY=SSL;"
         logger.info("SSL security enabled for DB2 connection")
 
     # Log connection details (mask password)
     masked_conn_str = conn_str.replace(config['password'], '***MASKED***')
     logger.info(f"Attempting DB2 connection with string: {masked_conn_str}")
 
-    # Test network connectivity first
-    logger.debug(f"Testing TCP connectivity to {config['host']}:{config.get('port', 446)}")
-    try:
-        test_sock = socket.socket()
-        test_sock.settimeout(5)
-        test_sock.connect((config['host'], config.get('port', 446)))
-        test_sock.close()
-        logger.info(f"TCP connection successful to {config['host']}:{config.get('port', 446)}")
-    except Exception as e:
-        logger.error(f"TCP connection failed to {config['host']}:{config.get('port', 446)}: {e}")
-        logger.error("This indicates a network/firewall issue - DB2 server is not reachable")
-
     # Attempt DB2 connection
     logger.info("Initiating DB2 connection...")
     try:
@@ -86,7 +187,8 @@ def connect_to_db2(config=None):
             server_info = ibm_db.server_info(conn)
             if server_info:
                 logger.info(f"Connected to DB2 server: {server_info.DBMS_NAME} {server_info.DBMS_VER}")
-                logger.debug(f"Server details: {vars(server_info)}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Server details: {vars(server_info)}")
         except Exception as e:
             logger.debug(f"Could not retrieve server info: {e}")
 
@@ -122,25 +224,161 @@ def connect_to_db2(config=None):
             logger.error(f"DB2 Error Message: {error_msg}")
         except:
             logger.error("Could not retrieve detailed DB2 error information")
+            error_msg = ""
+
+        # Credentials may have been rotated - re-read the secret on the next attempt
+        if _is_auth_error(f"{e} {error_msg}"):
+            invalidate_secret_cache()
+        else:
+            _log_tcp_diagnosis(config)
+        raise
+
+def _log_tcp_diagnosis(config):
+    """After a failed connect, probe the DB2 port to tell network problems apart from DB2 ones"""
+    host, port = config['host'], config.get('port', 446)
+    try:
+        latency_ms = check_tcp(host, port, timeout=5)
+        logger.info(f"TCP connection successful to {host}:{port} ({latency_ms:.1f} ms) - the failure is on the DB2 side")
+    except Exception as e:
+        logger.error(f"TCP connection failed to {host}:{port}: {e}")
+        logger.error("This indicates a network/firewall issue - DB2 server is not reachable")
+
+# Pool of open DB2 connections so /run doesn't pay the TCP/SSL/auth handshake every call
+DB2_POOL_SIZE = int(os.environ.get("DB2_POOL_SIZE", "4"))
+# Below common idle-TCP cutoffs (Cloud NAT drops idle flows after 1200s); a connection the
+# server dropped anyway is caught by the one-time reconnect in execute_query/iter_query_batches
+DB2_POOL_RECYCLE = int(os.environ.get("DB2_POOL_RECYCLE", "900"))
+_DB2_POOL = queue.LifoQueue(maxsize=DB2_POOL_SIZE)
+# Prepared statements per open connection, keyed by SQL text, so repeat runs skip DB2's prepare
+_STMT_CACHE = {}
+_STMT_CACHE_PER_CONN = 16
+
+@contextmanager
+def db2_connection(fresh=False):
+    """Borrow a pooled DB2 connection (a newly opened one with fresh=True); it goes back to
+    the pool unless the block raised"""
+    conn, created, key = _checkout_connection(fresh)
+    try:
+        yield conn
+    except BaseException:
+        _close_quietly(conn)
         raise
+    _checkin_connection(conn, created, key)
+
+def _pool_key(config):
+    """Fingerprint of the connection settings a pooled connection was opened with"""
+    return hashlib.sha256(build_connection_string(config).encode()).hexdigest()
+
+def _checkout_connection(fresh=False):
+    """Take the most recently used live connection from the pool, or open a new one
+
+    Connections opened with different settings (e.g. before a secret rotation or host
+    change picked up via ?refresh=1) are closed rather than reused.
+    """
+    import ibm_db
+
+    config = get_secret_payload()
+    key = _pool_key(config)
+    if fresh:
+        return connect_to_db2(config), time.monotonic(), key
+    while True:
+        try:
+            conn, created, conn_key = _DB2_POOL.get_nowait()
+        except queue.Empty:
+            return connect_to_db2(config), time.monotonic(), key
+        if conn_key == key and time.monotonic() - created < DB2_POOL_RECYCLE and ibm_db.active(conn):
+            return conn, created, key
+        _close_quietly(conn)
+
+def _checkin_connection(conn, created, key):
+    """Return a connection to the pool, closing it if the pool is already full"""
+    try:
+        _DB2_POOL.put_nowait((conn, created, key))
+    except queue.Full:
+        _close_quietly(conn)
+
+def _is_connection_lost(error):
+    """Check whether a DB2 error means the connection itself is gone (SQLSTATE class 08,
+    40003 or SQL30081N), e.g. a pooled connection the server or a NAT dropped while idle"""
+    state = _sqlstate(None, error)
+    return state.startswith("08") or state == "40003" or "SQL30081N" in str(error)
+
+def _discard_idle_connections(error):
+    """Log a lost pooled connection and close the other idle ones, which idled just as long"""
+    logger.warning(f"Pooled DB2 connection was lost ({error}); retrying once on a new connection")
+    close_db2_pool()
 
-def exec_with_retry(conn, sql, max_retries=3):
-    """Execute SQL with retry logic for deadlock/timeout errors"""
+def _close_quietly(conn):
+    import ibm_db
+
+    _STMT_CACHE.pop(conn, None)
+    try:
+        ibm_db.close(conn)
+    except Exception as e:
+        logger.debug(f"Ignoring error closing DB2 connection: {e}")
+
+@atexit.register
+def close_db2_pool():
+    """Close every pooled DB2 connection (runs at interpreter exit)"""
+    while True:
+        try:
+            conn, _, _ = _DB2_POOL.get_nowait()
+        except queue.Empty:
+            return
+        _close_quietly(conn)
+
+# SQLSTATEs of deadlock/lock-timeout failures worth retrying: 57033 (SQLCODE -913),
+# 40001 (rolled back, SQLCODE -911) and 40XL1 (lock timeout)
+_RETRY_SQLSTATES = frozenset(('57033', '40001', '40XL1'))
+
+# ibm_db error messages end with "SQLSTATE=xxxxx SQLCODE=-nnn"
+_SQLSTATE_IN_MESSAGE = re.compile(r"SQLSTATE=(\w{5})")
+
+def _sqlstate(stmt, error):
+    """SQLSTATE of a failed execution ('' if none): from the failing statement handle, else
+    parsed from the exception message
+
+    Never read from ibm_db's handle-less last-error buffer, which every thread shares and which
+    may still hold an earlier failure. A failed prepare or exec_immediate leaves no statement
+    handle (and no error on the connection handle), so its state comes from the message.
+    """
+    if stmt is not None:
+        import ibm_db
+
+        try:
+            state = ibm_db.stmt_error(stmt)
+        except Exception:
+            state = ""
+        if state:
+            return state
+    match = _SQLSTATE_IN_MESSAGE.search(str(error))
+    return match.group(1) if match else ""
+
+def _is_lock_error(message):
+    """Check whether a DB2 error message indicates a deadlock or lock timeout"""
+    return "-913" in message or "SQL0913N" in message or "57033" in message or "deadlock" in message.lower()
+
+def exec_with_retry(conn, sql, max_retries=3, params=None):
+    """Execute SQL with retry logic for deadlock/timeout errors (prepared with ? markers when params are given)"""
     import ibm_db
 
     attempt = 0
     while True:
+        stmt = None
         try:
+            if params:
+                stmt = _prepared(conn, sql)
+                _bind_params(stmt, params)
+                ibm_db.execute(stmt)
+                return stmt
             return ibm_db.exec_immediate(conn, sql)
         except Exception as e:
-            # Look for SQLSTATE 57033 or SQLCODE -913 (deadlock/timeout)
-            msg = str(e)
-            try:
-                state = ibm_db.stmt_errormsg()
-            except:
-                state = ""
-
-            if ("-913" in msg or "SQL0913N" in msg or "57033" in msg or "57033" in state or "deadlock" in msg.lower()):
+            # Don't hand a statement that just failed to the next run
+            _STMT_CACHE.get(conn, {}).pop(sql, None)
+            # stmt is still None when prepare (or exec_immediate) itself failed
+            state = _sqlstate(stmt, e)
+            # Classify on SQLSTATE; the message scan is only for drivers that don't report one
+            if state in _RETRY_SQLSTATES or (not state and _is_lock_error(str(e))):
                 attempt += 1
                 if attempt > max_retries:
                     logger.error(f"Max retries ({max_retries}) exceeded for deadlock/timeout")
@@ -151,49 +389,75 @@ def exec_with_retry(conn, sql, max_retries=3):
                 continue
             raise
 
-def execute_query(query, start_date=None, end_date=None, conn=None):
-    """Execute a DB2 query and return results as DataFrame"""
+def _prepared(conn, sql):
+    """Return a prepared statement for sql on conn, reusing the one prepared by an earlier run"""
     import ibm_db
 
-    # Establish connection if not provided
-    close_conn = False
-    if conn is None:
-        conn = connect_to_db2()
-        close_conn = True
+    stmts = _STMT_CACHE.setdefault(conn, {})
+    stmt = stmts.get(sql)
+    if stmt is None:
+        if len(stmts) >= _STMT_CACHE_PER_CONN:
+            stmts.clear()
+        stmt = stmts[sql] = ibm_db.prepare(conn, sql)
+    else:
+        # Close the cursor left by the previous run before executing again
+        ibm_db.free_result(stmt)
+    return stmt
 
-    # Replace date parameters in query
-    if start_date and end_date:
-        query = query.replace(':START_DATE', f"'{start_date}'")
-        query = query.replace(':END_DATE', f"'{end_date}'")
+def _bind_params(stmt, params):
+    """Bind ? markers in order; dates go in as typed DATE values so DB2 can range-scan DATE indexes"""
+    import ibm_db
 
+    for position, value in enumerate(params, start=1):
+        if isinstance(value, date) and not isinstance(value, datetime):
+            ibm_db.bind_param(stmt, position, value, ibm_db.SQL_PARAM_INPUT, ibm_db.SQL_TYPE_DATE)
+        else:
+            ibm_db.bind_param(stmt, position, value)
+
+def execute_query(query, start_date=None, end_date=None, conn=None, params=None):
+    """Execute a DB2 query and return results as DataFrame
+
+    :START_DATE / :END_DATE and any :NAME in params are sent as bound parameters,
+    so DB2 can reuse the statement's access plan across runs.
+    """
+    query, values = bind_markers(query, start_date, end_date, params)
     logger.info(f"Executing DB2 query for date range: {start_date} to {end_date}")
 
+    # Columnar fetch through ODBC when enabled (an explicit ibm_db connection keeps the ibm_db path)
+    if DB2_FETCH_ENGINE == "arrow_odbc" and conn is None:
+        return _execute_query_arrow(query, values)
+
+    if conn is not None:
+        return _fetch_dataframe(conn, query, values)
+
+    # Borrow a pooled connection; if it turns out to be dead, the query has returned nothing
+    # yet, so it is re-run once on a newly opened connection
     try:
-        stmt = exec_with_retry(conn, query)
+        with db2_connection() as pooled:
+            return _fetch_dataframe(pooled, query, values)
+    except Exception as e:
+        if not _is_connection_lost(e):
+            raise
+        _discard_idle_connections(e)
+    with db2_connection(fresh=True) as conn:
+        return _fetch_dataframe(conn, query, values)
+
+def _fetch_dataframe(conn, query, values):
+    """Run a bound query on an open connection and return the rows as a DataFrame"""
+    import ibm_db
+
+    try:
+        stmt = exec_with_retry(conn, query, params=values)
         logger.info("Query executed successfully, fetching results...")
     except Exception as e:
-        logger.error(f"Query execution failed: {str(e)}")
-        try:
-            error_msg = ibm_db.stmt_errormsg()
-            error_code = ibm_db.stmt_error()
-            logger.error(f"DB2 Statement Error Code: {error_code}")
-            logger.error(f"DB2 Statement Error Message: {error_msg}")
-        except:
-            pass
-        if close_conn:
-            ibm_db.close(conn)
+        # The exception carries this statement's own message and SQLSTATE; ibm_db's handle-less
+        # stmt_errormsg() could report another thread's failure
+        logger.error(f"Query execution failed (SQLSTATE {_sqlstate(None, e) or 'unknown'}): {e}")
         raise
 
-    # Fetch results
-    data = []
-    row_count = 0
-    row = ibm_db.fetch_assoc(stmt)
-    while row:
-        data.append(row)
-        row_count += 1
-        if row_count % 100 == 0:
-            logger.info(f"Fetched {row_count} rows from DB2...")
-        row = ibm_db.fetch_assoc(stmt)
+    # Convert each chunk as it arrives so only FETCH_BATCH_ROWS row tuples are alive at a time
+    frames = list(_iter_stmt_frames(stmt, FETCH_BATCH_ROWS))
+    row_count = sum(len(frame) for frame in frames)
 
     logger.info(f"DB2 Query completed. Total rows fetched: {row_count}")
 
@@ -204,25 +468,206 @@ def execute_query(query, start_date=None, end_date=None, conn=None):
     except Exception as e:
         logger.warning(f"Could not commit transaction: {e}")
 
-    if close_conn:
-        ibm_db.close(conn)
-        logger.info("DB2 connection closed")
-
     # Convert to DataFrame
-    df = pd.DataFrame(data)
-    if not df.empty:
-        df.columns = df.columns.str.lower()
+    df = pd.concat(frames, ignore_index=True, copy=False) if frames else pd.DataFrame()
 
     logger.info(f"DataFrame created with {len(df)} rows")
     return df
 
+def _execute_query_arrow(query, values=(), config=None):
+    """Execute a DB2 query via arrow-odbc, reading columnar batches straight into Arrow buffers"""
+    from arrow_odbc import read_arrow_batches_from_odbc
+    import pyarrow as pa
+
+    if config is None:
+        config = get_secret_payload()
+    conn_str = f"DRIVER={{{DB2_ODBC_DRIVER}}};" + build_connection_string(config)
+
+    reader = read_arrow_batches_from_odbc(
+        query=query,
+        connection_string=conn_str,
+        batch_size=ARROW_BATCH_SIZE,
+        parameters=_odbc_parameters(values),
+        fetch_concurrently=FETCH_CONCURRENT
+    )
+    table = pa.Table.from_batches(list(reader), schema=reader.schema)
+    logger.info(f"DB2 Query completed via arrow-odbc. Total rows fetched: {table.num_rows}")
+
+    df = _arrow_to_pandas(table)
+    logger.info(f"DataFrame created with {len(df)} rows")
+    return df
+
+def iter_query_batches(query, start_date=None, end_date=None, batch_size=ARROW_BATCH_SIZE, params=None):
+    """Execute a DB2 query and yield the results as DataFrames of up to batch_size rows"""
+    query, values = bind_markers(query, start_date, end_date, params)
+    logger.info(f"Streaming DB2 query for date range: {start_date} to {end_date} in batches of {batch_size}")
+
+    if DB2_FETCH_ENGINE == "arrow_odbc":
+        yield from _iter_query_batches_arrow(query, batch_size, values)
+        return
+
+    import ibm_db
+
+    # A pooled connection that turns out to be dead is replaced once, as long as no batch
+    # has been handed out yet (after that a re-run would yield rows twice)
+    for fresh in (False, True):
+        row_count = 0
+        try:
+            with db2_connection(fresh) as conn:
+                stmt = exec_with_retry(conn, query, params=values)
+
+                for frame in _iter_stmt_frames(stmt, batch_size):
+                    row_count += len(frame)
+                    logger.info(f"Fetched {row_count} rows from DB2...")
+                    yield frame
+
+                logger.info(f"DB2 Query completed. Total rows fetched: {row_count}")
+                try:
+                    ibm_db.commit(conn)
+                except Exception as e:
+                    logger.warning(f"Could not commit transaction: {e}")
+            return
+        except Exception as e:
+            if fresh or row_count or not _is_connection_lost(e):
+                raise
+            _discard_idle_connections(e)
+
+def _iter_stmt_frames(stmt, batch_size):
+    """Yield an executed statement's rows as DataFrames of up to batch_size rows"""
+    import ibm_db
+
+    columns = [ibm_db.field_name(stmt, i).lower() for i in range(ibm_db.num_fields(stmt))]
+    fetch_tuple = ibm_db.fetch_tuple
+    while True:
+        rows = []
+        rows_append = rows.append
+        row = fetch_tuple(stmt)
+        while row:
+            rows_append(row)
+            if len(rows) == batch_size:
+                break
+            row = fetch_tuple(stmt)
+        if not rows:
+            return
+        yield _rows_to_frame(rows, columns)
+        if len(rows) < batch_size:
+            return
+
+def _rows_to_frame(rows, columns):
+    """Build a chunk's DataFrame through Arrow columns, so text lands in Arrow buffers
+    instead of one Python str per cell (about half the memory of from_records)"""
+    import pyarrow as pa
+
+    arrays, mixed = [], {}
+    for name, values in zip(columns, zip(*rows)):
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # A column mixing Python types is left to pandas to infer; the others stay columnar
+            arrays.append(pa.nulls(len(values)))
+            mixed[name] = values
+    df = _arrow_to_pandas(pa.Table.from_arrays(arrays, names=columns))
+    for name, values in mixed.items():
+        df[name] = pd.Series(values, index=df.index)
+    return df
+
+def _iter_query_batches_arrow(query, batch_size, values=(), config=None):
+    """Yield arrow-odbc record batches as DataFrames"""
+    from arrow_odbc import read_arrow_batches_from_odbc
+
+    if config is None:
+        config = get_secret_payload()
+    conn_str = f"DRIVER={{{DB2_ODBC_DRIVER}}};" + build_connection_string(config)
+
+    reader = read_arrow_batches_from_odbc(
+        query=query,
+        connection_string=conn_str,
+        batch_size=batch_size,
+        parameters=_odbc_parameters(values),
+        fetch_concurrently=FETCH_CONCURRENT
+    )
+    for batch in reader:
+        yield _arrow_to_pandas(batch)
+
+def _arrow_to_pandas(data):
+    """Convert an Arrow table/batch to pandas, keeping text columns in their Arrow buffers
+
+    Text columns become string[pyarrow] rather than Python str objects, so they are not
+    copied here and go back to Arrow for the BigQuery upload without another copy.
+    """
+    import pyarrow as pa
+
+    string_dtype = pd.StringDtype("pyarrow")
+    df = data.to_pandas(types_mapper={pa.string(): string_dtype, pa.large_string(): string_dtype}.get)
+    df.columns = df.columns.str.lower()
+    return df
+
+_NAMED_MARKER = re.compile(r":([A-Z][A-Z0-9_]*)\b")
+
+def bind_markers(query, start_date=None, end_date=None, params=None):
+    """Turn :NAME placeholders into ? markers, returning the SQL and the values in marker order"""
+    named = dict(params or {})
+    if start_date and end_date:
+        named['START_DATE'] = _as_date(start_date)
+        named['END_DATE'] = _as_date(end_date)
+
+    values = []
+    def to_marker(match):
+        if match.group(1) not in named:
+            return match.group(0)
+        values.append(named[match.group(1)])
+        return '?'
+
+    return _NAMED_MARKER.sub(to_marker, query), values
+
+def _as_date(value):
+    """Accept a date or an ISO 'YYYY-MM-DD' string (as passed through from /run)"""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def _odbc_parameters(values):
+    """arrow-odbc binds parameters as text (DB2 casts the parameter, not the column, so indexes still apply)"""
+    return [None if value is None else str(value) for value in values] or None
+
+def build_record_key(df, key_columns, date_column):
+    """Build '<key>_<key>_<YYYYMMDD>' record keys for a whole frame ('NULL' for missing dates)"""
+    # YYYYMMDD from integer arithmetic: ~4x faster than dt.strftime, which formats row by row
+    dates = pd.to_datetime(df[date_column], errors='coerce')
+    ymd = (dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).fillna(0).astype('int64')
+    date_str = ymd.astype(str).where(dates.notna(), 'NULL')
+    record_key = _as_str(df[key_columns[0]])
+    for col in key_columns[1:]:
+        record_key = record_key + '_' + _as_str(df[col])
+    return record_key + '_' + date_str
+
+def to_categorical(df, columns):
+    """Store low-cardinality text columns as categoricals (each distinct value kept once)"""
+    for col in columns:
+        if col in df.columns and pd.api.types.is_string_dtype(df[col]):
+            df[col] = df[col].astype('category')
+    return df
+
+def _as_str(values):
+    """Return a column as strings, skipping the copy when it already holds only strings"""
+    # Categoricals of strings pass is_string_dtype but don't support '+', so they are cast too
+    if (not values.hasnans and pd.api.types.is_string_dtype(values)
+            and not isinstance(values.dtype, pd.CategoricalDtype)):
+        return values
+    return values.astype(str)
+
+ROLLING_DAYS_BACK = 30
+ROLLING_DAYS_FORWARD = 60
+
+def rolling_window(today=None, days_back=ROLLING_DAYS_BACK, days_forward=ROLLING_DAYS_FORWARD):
+    """Return the (start, end) dates of the rolling window around today"""
+    if today is None:
+        today = date.today()
+    return today - timedelta(days=days_back), today + timedelta(days=days_forward)
+
 def get_date_range(use_rolling_window=True, start_date=None, end_date=None):
     """Calculate date range for queries"""
     if use_rolling_window:
         # Use rolling window: 30 days back, 60 days forward from today
-        today = date.today()
-        start_date = today - timedelta(days=30)
-        end_date = today + timedelta(days=60)
+        start_date, end_date = rolling_window()
         logger.info(f"Using rolling window: {start_date} to {end_date} (30 days back, 60 days forward)")
     else:
         # Use provided dates